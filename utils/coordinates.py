@@ -5,46 +5,89 @@ Input: 원본 parquet
 Output: 그리드컬럼을 제외한 5179
 """
 
-import pandas as pd
-from shapely.geometry import Point
-import pyarrow, duckdb, argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import duckdb, argparse
 
 X_MAPPING = list("ABCDEFG")
 Y_MAPPING = list("BCDEFGH")
 
-def _convert_single_grid_to_point(grid_id: str) -> Point | None:
-    if not isinstance(grid_id, str) or len(grid_id) < 12:
-        return None
+# 접두사 2글자 -> 번호 (x 인덱스 * 7 + y 인덱스) 룩업 테이블
+PREFIXES = pa.array([x + y for x in X_MAPPING for y in Y_MAPPING])
+GRID_PATTERN = r'^[A-G][B-H][0-9]{10,}$'
+SRID = 5179
 
-    try:
-        x_char, y_char = grid_id[0], grid_id[1]
+def _as_array(values) -> pa.Array:
+    if isinstance(values, pa.ChunkedArray):
+        return values.combine_chunks()
+    if isinstance(values, pa.Array):
+        return values
+    return pa.array(values, type=pa.string(), from_pandas=True)
 
-        x_index = X_MAPPING.index(x_char)
-        y_index = Y_MAPPING.index(y_char)
-
-        x_tail = int(grid_id[2:7])
-        y_tail = int(grid_id[7:])
-
-    except (ValueError, IndexError):
-        return None
+def grid_to_xy(grid_ids) -> tuple[pa.Array, pa.Array]:
+    """
+    그리드 ID 배열 -> EPSG:5179 x, y 정수 배열 (행 단위 파싱 없이 Arrow 일괄 변환)
+    - 접두사 2글자는 룩업 테이블, 숫자는 고정 위치(2:7, 7:) 슬라이스 후 일괄 캐스팅
+    - 형식이 맞지 않는 ID(길이 12 미만, 범위 밖 문자 등)는 null
+    """
+    ids = _as_array(grid_ids)
+    ids = pc.if_else(pc.match_substring_regex(ids, GRID_PATTERN), ids, pa.scalar(None, ids.type))
 
-    x_coord = (x_index + 7) * 100_000 + x_tail
-    y_coord = (y_index + 14) * 100_000 + y_tail
+    prefix = pc.cast(pc.index_in(pc.utf8_slice_codeunits(ids, 0, 2), value_set=PREFIXES), pa.int64())
+    x_tail = pc.cast(pc.utf8_slice_codeunits(ids, 2, 7), pa.int64())
+    y_tail = pc.cast(pc.utf8_slice_codeunits(ids, 7), pa.int64())
 
-    return Point(x_coord, y_coord)
+    x = pc.add(pc.multiply(pc.add(pc.divide(prefix, 7), 7), 100_000), x_tail)
+    y = pc.add(pc.multiply(pc.add(pc.subtract(prefix, pc.multiply(pc.divide(prefix, 7), 7)), 14), 100_000), y_tail)
+    return x, y
 
-def grid_to_5179_wkt(grid_ids:pd.Series) -> pd.Series:
+def xy_to_wkb(x, y, srid: int | None = None) -> pa.Array:
+    """
+    x, y 배열 -> Point WKB (little endian) 배열, srid를 주면 PostGIS EWKB
+    좌표가 null이면 null
+    """
+    x, y = _as_array(x), _as_array(y)
+    fields = [('order', 'u1'), ('type', '<u4')]
+    if srid is not None:
+        fields.append(('srid', '<u4'))
+    dtype = np.dtype(fields + [('x', '<f8'), ('y', '<f8')])
+
+    n = len(x)
+    buf = np.zeros(n, dtype=dtype)
+    buf['order'] = 1
+    buf['type'] = 1 if srid is None else 1 | 0x20000000
+    if srid is not None:
+        buf['srid'] = srid
+    buf['x'] = pc.fill_null(pc.cast(x, pa.float64()), 0).to_numpy()
+    buf['y'] = pc.fill_null(pc.cast(y, pa.float64()), 0).to_numpy()
+
+    offsets = np.arange(n + 1, dtype=np.int32) * dtype.itemsize
+    wkb = pa.Array.from_buffers(pa.binary(), n, [None, pa.py_buffer(offsets), pa.py_buffer(buf.tobytes())])
+    valid = pc.and_(pc.is_valid(x), pc.is_valid(y))
+    return pc.if_else(valid, wkb, pa.scalar(None, pa.binary()))
+
+def xy_to_wkt(x, y) -> pa.Array:
+    "x, y 정수 배열 -> 'POINT (x y)' 문자열 배열 (shapely Point.wkt와 동일 표기)"
+    return pc.binary_join_element_wise('POINT (', pc.cast(_as_array(x), pa.string()), ' ',
+                                       pc.cast(_as_array(y), pa.string()), ')', '')
+
+# DuckDB Arrow UDF (그리드 ID -> 좌표/WKB/WKT)
+def grid_to_5179_wkb(grid_ids) -> pa.Array:
+    "그리드 ID -> EPSG:5179 Point WKB"
+    return xy_to_wkb(*grid_to_xy(grid_ids))
+
+def grid_to_5179_wkt(grid_ids) -> pa.Array:
     """
-    DuckDB가 지리공간 타입을 직접 지원하지 않음으로
-    그리드 ID 시리즈 -> EPSG:5179의 WKT 문자열 시리즈로 변환함.
+    그리드 ID -> EPSG:5179 WKT 문자열 (요청 시에만 사용, 기본은 WKB)
     """
-    if isinstance(grid_ids, (pyarrow.ChunkedArray, pyarrow.Array)):
-        # to_pandas() 메서드를 사용하여 Series로 변환
-        grid_ids = grid_ids.to_pandas()
+    return xy_to_wkt(*grid_to_xy(grid_ids))
 
-    points = grid_ids.apply(_convert_single_grid_to_point)
+def grid_to_5179_x(grid_ids) -> pa.Array:
+    return grid_to_xy(grid_ids)[0]
 
-    return points.apply(lambda p: p.wkt if p is not None else None)
+def grid_to_5179_y(grid_ids) -> pa.Array:
+    return grid_to_xy(grid_ids)[1]
 
 """파서를 받아서 grid 붙여서 그리드 컬럼 제외하고 parquet으로 저장해주는 것"""
 
@@ -59,6 +102,8 @@ def main():
                         help="좌표 변환에 사용할 grid ID 컬럼 이름 (승차/하차 접두사 제외, 예: '_gridid')")
     parser.add_argument("--new_coords_col", type=str, required=True,
                         help="새롭게 정의될 5179좌표 컬럼명 (승차/하차 접두사 제외, 예: '_coords_5179')")
+    parser.add_argument("--geometry_format", type=str, default="wkb", choices=["wkb", "wkt", "xy"],
+                        help="좌표 출력 형식: wkb(BLOB, 기본), wkt(문자열), xy(컬럼명_x, 컬럼명_y 정수 2개 컬럼)")
     args = parser.parse_args()
 
     print("데이터 처리 시작...")
@@ -66,13 +111,13 @@ def main():
     # DuckDB 연결
     con = duckdb.connect()
 
-    # UDF 등록
-    con.create_function('GRID_TO_5179_UDF',
-                        grid_to_5179_wkt,
-                        ['VARCHAR'],
-                        'VARCHAR',
-                        type='arrow',
-                        null_handling='special')
+    # UDF 등록 (Arrow 배열 단위 일괄 변환)
+    udfs = {'GRID_TO_5179_WKB': (grid_to_5179_wkb, 'BLOB'),
+            'GRID_TO_5179_WKT': (grid_to_5179_wkt, 'VARCHAR'),
+            'GRID_TO_5179_X': (grid_to_5179_x, 'BIGINT'),
+            'GRID_TO_5179_Y': (grid_to_5179_y, 'BIGINT')}
+    for name, (func, return_type) in udfs.items():
+        con.create_function(name, func, ['VARCHAR'], return_type, type='arrow', null_handling='special')
 
     last_cte_name = "source"
     ctes = [f"""{last_cte_name} AS (
@@ -88,9 +133,14 @@ def main():
         grid_col = f"{prefix}{args.grid_id_col}"
         coords_col = f"{prefix}{args.new_coords_col}"
 
+        if args.geometry_format == "xy":
+            coords_expr = (f'GRID_TO_5179_X("{grid_col}") AS "{coords_col}_x", '
+                           f'GRID_TO_5179_Y("{grid_col}") AS "{coords_col}_y"')
+        else:
+            coords_expr = f'GRID_TO_5179_{args.geometry_format.upper()}("{grid_col}") AS "{coords_col}"'
         ctes.append(f"""
             {new_cte_name} AS (
-                SELECT *, GRID_TO_5179_UDF("{grid_col}") AS "{coords_col}" 
+                SELECT *, {coords_expr} 
                 FROM {last_cte_name}
             )
         """)
@@ -98,7 +148,8 @@ def main():
         cols_to_exclude.append(grid_col)
 
         with_clause = "WITH " + ", ".join(ctes)
-        exclude_clause = f"EXCLUDE ({', '.join([f'\"{col}\"' for col in cols_to_exclude])})" if cols_to_exclude else ""
+        quoted_cols = ', '.join(f'"{col}"' for col in cols_to_exclude)
+        exclude_clause = f"EXCLUDE ({quoted_cols})" if cols_to_exclude else ""
 
     # 최종 쿼리 조합
     query = f"""COPY ( 
@@ -22,101 +22,204 @@
 
 from __future__ import annotations
 
-import io, os
+import io, os, sys
 import pendulum
 from typing import List, Dict
 import logging
 import s3fs
 import boto3
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 import pyarrow.parquet as pq
-import shapely.geometry as sg
 from airflow.decorators import dag, task
 from airflow.models import Variable
 from airflow.providers.amazon.aws.hooks.s3 import S3Hook
 from airflow.providers.postgres.hooks.postgres import PostgresHook
-from airflow.operators.python import PythonVirtualenvOperator
 from botocore.exceptions import ClientError
 from airflow.exceptions import AirflowSkipException
-from shapely.geometry import Point
+
+# 그리드 -> 5179 좌표 변환은 같은 폴더의 coordinates.py, 영업일 달력은 calendar_dim.py 구현을 공용으로 사용
+# (저장소에서는 version_2/calendar_dim.py, 배포 시 DAG 폴더에 함께 복사)
+DAG_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [DAG_DIR, os.path.join(DAG_DIR, '..', 'version_2')]
+from coordinates import grid_to_xy, SRID
 
 # -------------- 전역 설정 --------------
 # S3 설정
 AWS_CONN_ID = 's3_bv_dropbox'
 S3_BUCKET_NAME = 'bv-dropbox'
+# 한국 영업일 달력 (없거나 대상 월이 빠져 있으면 ensure_calendar 태스크가 생성 후 업로드)
+CALENDAR_KEY = "교통카드/calendar/calendar_dim.parquet"
+# 변환 결과 스테이징 경로 (태스크 간에는 이 경로만 XCom으로 전달)
+STAGING_KEY = "교통카드/통근OD/{ym}/staging/{ym}_workod_postgis.parquet"
 
 # 업로드할 DB 접속 정보
 POSTGRES_CONN_ID = 'dn_airflow'
 SCHEMA = 'transportation'
-
-# 그리드 변환용 매핑
-X_MAPPING = list("ABCDEFG")
-Y_MAPPING = list("BCDEFGH")
+# COPY 1회당 행 수 (스테이징 parquet row group 크기와 동일, 적재 메모리 상한)
+COPY_BATCH_ROWS = 200_000
+# 적재 컬럼 (스테이징 parquet 컬럼 순서 = COPY 컬럼 순서)
+DB_COLS = [
+    "standard_ym",
+    "departure_station_id",
+    "departure_station_name",
+    "departure_region_code",
+    "departure_station_type",
+    "departure_grid_id",
+    "arrival_station_id",
+    "arrival_station_name",
+    "arrival_region_code",
+    "arrival_station_type",
+    "arrival_grid_id",
+    "purpose_name",
+    "daily_use_count",
+    "median_elapse_time",
+    "average_elapse_time",
+    "median_distance",
+    "average_distance",
+    "departure_station_geometry",
+    "arrival_station_geometry",
+]
+
+# EWKB(Point, SRID) 바이트 레이아웃과 16진수 변환표
+EWKB_POINT = np.dtype([('order', 'u1'), ('type', '<u4'), ('srid', '<u4'), ('x', '<f8'), ('y', '<f8')])
+HEX_TABLE = np.array([f'{i:02X}'.encode() for i in range(256)], dtype='S2')
+# 영문 그리드 접두사 2글자 -> 국가표준 한글 접두사 룩업 테이블
+GRID_LATIN = "ABCDEFGH"
+GRID_HANGUL = "가나다라마바사아"
+PREFIX_LATIN = pa.array([a + b for a in GRID_LATIN for b in GRID_LATIN])
+PREFIX_HANGUL = pa.array([a + b for a in GRID_HANGUL for b in GRID_HANGUL])
+# 원본 컬럼 -> 적재 컬럼 (이름만 바뀌는 컬럼)
+RENAME_COLS = {
+    '승차정류장ID':'departure_station_id',
+    '승차정류장명칭':'departure_station_name',
+    '승차지역코드':'departure_region_code',
+    '승차교통수단구분':'departure_station_type',
+    '하차정류장ID':'arrival_station_id',
+    '하차정류장명칭':'arrival_station_name',
+    '하차지역코드':'arrival_region_code',
+    '하차교통수단구분':'arrival_station_type',
+    '탑승시간_중위':'median_elapse_time',
+    '탑승시간_평균':'average_elapse_time',
+    '이동거리_중위':'median_distance',
+    '이동거리_평균':'average_distance',
+}
+SOURCE_COLS = list(RENAME_COLS) + ['승차그리드ID', '하차그리드ID', '월_총_통행량', '출퇴근구분']
 
 # DAG 월 미입력 시 기본값
 DEFAULT_MONTH = ["202501"] # , "202502", "202503", "202504", "202505", "202506"
 
 # Helper 함수
-def convert_grid_to_5179(grid_id: str) -> Point | None:
+def get_s3_filesystem() -> s3fs.S3FileSystem:
     """
-    단일 그리드 ID -> Point 객체 변환
+    S3Hook 자격증명으로 s3fs 파일시스템 생성
     """
-    if not isinstance(grid_id, str) or len(grid_id) < 12:
-        return None
-    try:
-        x_char, y_char = grid_id[0], grid_id[1]
-
-        x_index = X_MAPPING.index(x_char)
-        y_index = Y_MAPPING.index(y_char)
-
-        x_tail = int(grid_id[2:7])
-        y_tail = int(grid_id[7:])
-    except (ValueError, IndexError):
-        return None
-    
-    x = (x_index + 7) * 100_000 + x_tail
-    y = (y_index + 14) * 100_000 + y_tail
-    return Point(x, y)
+    session = S3Hook(aws_conn_id=AWS_CONN_ID).get_session()
+    credentials = session.get_credentials()
+    return s3fs.S3FileSystem(
+        key=credentials.access_key,
+        secret=credentials.secret_key,
+        token=credentials.token,
+        client_kwargs={"region_name": session.region_name},
+    )
+
+def to_hangul_grid(grid_ids: pa.Array) -> pa.Array:
+    """
+    영문 그리드 ID -> 국가표준 한글 그리드 ID (접두사 2글자만 룩업 테이블로 교체)
+    접두사가 A~H 2글자가 아니면 원래 값 유지 (large_string 입력은 string으로 맞춰서 처리)
+    """
+    grid_ids = pc.cast(grid_ids, pa.string())
+    idx = pc.index_in(pc.utf8_slice_codeunits(grid_ids, 0, 2), value_set=PREFIX_LATIN)
+    translated = pc.binary_join_element_wise(PREFIX_HANGUL.take(idx), pc.utf8_slice_codeunits(grid_ids, 2), '')
+    return pc.if_else(pc.is_null(idx), grid_ids, translated)
+
+def transform_batch(batch: pa.RecordBatch, ym: str, business_days: int) -> pa.RecordBatch:
+    """
+    원본 레코드 배치 -> 적재용 레코드 배치 (DB_COLS 순서)
+    좌표 변환, 일평균 이용건수, 목적명칭, 한글 그리드, 컬럼명 표준화를 배치 단위 Arrow 연산으로 처리
+    """
+    columns = {new: batch.column(old) for old, new in RENAME_COLS.items()}
+    columns['standard_ym'] = pa.array([ym] * batch.num_rows, type=pa.string())
+    columns['departure_grid_id'] = to_hangul_grid(batch.column('승차그리드ID'))
+    columns['arrival_grid_id'] = to_hangul_grid(batch.column('하차그리드ID'))
+    columns['purpose_name'] = pa.array(['출근', '퇴근']).take(
+        pc.index_in(batch.column('출퇴근구분'), value_set=pa.array(['morning', 'evening'])))
+    columns['daily_use_count'] = pc.round(pc.divide(pc.cast(batch.column('월_총_통행량'), pa.float64()),
+                                                    business_days), 1)
+    columns['departure_station_geometry'] = grid_to_5179_ewkb_hex(batch.column('승차그리드ID'))
+    columns['arrival_station_geometry'] = grid_to_5179_ewkb_hex(batch.column('하차그리드ID'))
+    return pa.RecordBatch.from_arrays([columns[c] for c in DB_COLS], names=DB_COLS)
+
+def grid_to_5179_ewkb_hex(grid_ids) -> pa.Array:
+    """
+    그리드 ID 배열 -> EPSG:5179 Point EWKB 16진수 문자열 배열
+    PostGIS GEOMETRY(Point, 5179) 컬럼에 COPY로 그대로 적재 가능 (WKT와 달리 SRID 포함)
+    """
+    x, y = grid_to_xy(grid_ids)
+    n = len(x)
+    buf = np.zeros(n, dtype=EWKB_POINT)
+    buf['order'] = 1
+    buf['type'] = 1 | 0x20000000
+    buf['srid'] = SRID
+    buf['x'] = pc.fill_null(pc.cast(x, pa.float64()), 0).to_numpy()
+    buf['y'] = pc.fill_null(pc.cast(y, pa.float64()), 0).to_numpy()
 
-def apply_grid_to_5179(series: pd.Series) -> pd.Series:
-    return series.apply(convert_grid_to_5179)
+    hex_str = HEX_TABLE[buf.view(np.uint8).reshape(n, EWKB_POINT.itemsize)].view(f'S{2 * EWKB_POINT.itemsize}').ravel()
+    return pa.array(hex_str.astype(str), mask=pc.is_null(x).to_numpy(zero_copy_only=False))
 
 
 # ---------- DAG ----------
-@task.virtualenv(
-    task_id="get_korean_business_day_task", 
-    requirements=['pandas', 'pendulum', 'holidays'],
-    system_site_packages=False)
-def get_korean_business_day(ym:str) -> int:
+@task(task_id="ensure_calendar_task")
+def ensure_calendar(months: List[str]) -> str:
     """
-    YYYYMM형태의 문자열을 받아 해당 월의 영업일(평일) 수를 반환함
-    holidays 라이브러리를 활용하기 위해 가상환경오퍼레이터 활용
+    대상 월이 모두 들어 있는 S3 영업일 달력 경로를 반환함 (DAG 실행당 1회)
+    달력이 없거나 대상 연도가 빠져 있으면 calendar_dim.calendar_table로 기존 범위 + 대상 연도를 다시 만들어 업로드
+    (holidays 라이브러리는 이때만 필요, 월별 가상환경 생성 없음)
+    """
+    logger = logging.getLogger('airflow.task')
+    for ym in months:
+        if len(ym)!=6 or not ym.isdigit():
+            raise ValueError("YYYYMM형태의 문자열을 입력해야합니다.")
+
+    fs = get_s3_filesystem()
+    calendar_path = f"s3://{S3_BUCKET_NAME}/{CALENDAR_KEY}"
+    years = {int(ym[:4]) for ym in months}
+    covered = set()
+    if fs.exists(calendar_path):
+        covered = {int(ym[:4]) for ym in pq.read_table(calendar_path, filesystem=fs, columns=['year_month'])
+                   .column('year_month').unique().to_pylist()}
+        if years <= covered:
+            return calendar_path
+
+    from calendar_dim import calendar_table
+    years |= covered
+    table = pa.Table.from_pandas(calendar_table(range(min(years), max(years) + 1)), preserve_index=False)
+    pq.write_table(table, calendar_path, filesystem=fs, compression='zstd')
+    logger.info(f"Calendar built: {min(years)}~{max(years)} ({table.num_rows:,} days) -> {calendar_path}")
+    return calendar_path
+
+@task(task_id="get_korean_business_day_task")
+def get_korean_business_day(ym:str, calendar_path:str) -> int:
+    """
+    YYYYMM형태의 문자열을 받아 해당 월의 영업일(평일, 공휴일 제외) 수를 반환함
+    ensure_calendar가 준비한 S3 영업일 달력 parquet에서 조회 -> 가상환경 생성 없음
     """
-    import datetime as dt
-    import pandas as pd
-    import calendar
-    import holidays
-    import logging
     logger = logging.getLogger('airflow.task')
     
     if len(ym)!=6 or not ym.isdigit():
         raise ValueError("YYYYMM형태의 문자열을 입력해야합니다.")
-    year = int(ym[:4])
-    month = int(ym[4:6])
-    
-    start_date = dt.date(year, month, 1)
-    _, last_day = calendar.monthrange(year, month)
-    end_date = dt.date(year, month, last_day)
-    rng = pd.date_range(start=start_date, end=end_date, freq='D', tz='Asia/Seoul')
-    
-    is_weekday = rng.weekday < 5
-    _KR_HOLIDAYS= holidays.KR(years=[year])
-    holiday_ts = pd.Index([pd.Timestamp(d, tz='Asia/Seoul') for d in _KR_HOLIDAYS.keys()])
-    is_holiday = rng.isin(holiday_ts)
-    business_day_mask = is_weekday & ~is_holiday
-    logger.debug(f"Calculated business days for {ym}: {business_day_mask.sum()}")
+
+    table = pq.read_table(calendar_path, filesystem=get_s3_filesystem(),
+                          columns=['year_month', 'business_days_in_month'],
+                          filters=[('year_month', '=', ym)])
+    if table.num_rows == 0:
+        raise ValueError(f"달력 {calendar_path}에 {ym} 월이 없습니다.")
+    business_days = int(table['business_days_in_month'][0].as_py())
+    logger.debug(f"Business days for {ym}: {business_days}")
     
-    return int(business_day_mask.sum())
+    return business_days
 
 @dag(
     dag_id="교통카드_통근OD_후처리",
@@ -179,108 +282,43 @@ def transportation_data_postprocessing_2025():
             raise
     
     @task
-    def transform_parquet(s3_parquet_path: str, ym: str, business_days: int) -> str: # bytes -> str (파일 경로)
+    def transform_parquet(s3_parquet_path: str, ym: str, business_days: int) -> str: # 스테이징 parquet 경로
         """
-        1) Parquet -> DataFrame
-        2) 그리드 -> 5179 좌표 변환 -> wkt
-        3) 영문 그리드 -> 국가표준한글그리드
-        4) 영업일 기반 일 평균 이용건수 계산 등
-        5) 필요한 컬럼만 골라서 CSV 문자열으로 반환
+        원본 parquet을 레코드 배치 단위로 스트리밍 변환 (워커 메모리는 월 데이터 크기와 무관)
+        1) 그리드 -> 5179 좌표 변환 -> EWKB(16진수)
+        2) 영문 그리드 -> 국가표준한글그리드 (접두사 룩업)
+        3) 영업일 기반 일 평균 이용건수 계산 등
+        4) 필요한 컬럼만 골라서 스테이징 parquet으로 저장 후 경로 반환
         """
         logger = logging.getLogger('airflow.task')
         logger.info(f"Transforming data from S3 path: {s3_parquet_path}")
         
-        s3_hook = S3Hook(aws_conn_id=AWS_CONN_ID)
-        session = s3_hook.get_session()
-        credentials = session.get_credentials()
-        region_name = session.region_name
-        fs_kwargs = {
-            "key": credentials.access_key,
-            "secret": credentials.secret_key,
-            "token": credentials.token,
-            "client_kwargs": {"region_name": region_name},
-        }
-        fs = s3fs.S3FileSystem(**fs_kwargs)
-
-        # 1) Parquet -> DataFrame
-        table = pq.read_table(s3_parquet_path, filesystem=fs)
-        df = table.to_pandas()
-        logger.info(f"DataFrame loaded. Shape: {df.shape}")
-
-        # 2) 좌표 변환 (grid ID → EPSG:5179 Point)
-        vec_convert = pd.Series(df["승차그리드ID"]).apply(convert_grid_to_5179)
-        df["departure_station_geometry"] = vec_convert.apply(
-            lambda pt: pt.wkt if pt else None
-        )
-        vec_convert = pd.Series(df["하차그리드ID"]).apply(convert_grid_to_5179)
-        df["arrival_station_geometry"] = vec_convert.apply(
-            lambda pt: pt.wkt if pt else None
-        )
-
-            
-        # 3) 일평균 이용건수
-        df['daily_use_count'] = (df['월_총_통행량'] / business_days).round(1)
-        
-        # 4) 목적명칭 매핑
-        df['purpose_name'] = df['출퇴근구분'].map({'morning':'출근', 'evening':'퇴근'})
-        # 5) 기준연월 컬럼 추가
-        df['standard_ym'] = ym
-        # 6) 영문 그리드 -> 국가표준한글그리드 변환
-        grid_map = {'A':'가', 'B':'나', 'C':'다', 'D':'라', 'E':'마', 'F':'바', 'G':'사', 'H':'아'}
-        df['승차그리드ID'] = df['승차그리드ID'].replace(grid_map, regex=True)
-        df['하차그리드ID'] = df['하차그리드ID'].replace(grid_map, regex=True)
-
-        # 7) 컬럼명 영문 표준화
-        df_standardized = df.rename(columns={
-            '승차정류장ID':'departure_station_id',
-            '승차정류장명칭':'departure_station_name',
-            '승차지역코드':'departure_region_code',
-            '승차교통수단구분':'departure_station_type',
-            '승차그리드ID':'departure_grid_id',
-            '하차정류장ID':'arrival_station_id',
-            '하차정류장명칭':'arrival_station_name',
-            '하차지역코드':'arrival_region_code',
-            '하차교통수단구분':'arrival_station_type',
-            '하차그리드ID':'arrival_grid_id',
-            '탑승시간_중위':'median_elapse_time',
-            '탑승시간_평균':'average_elapse_time',
-            '이동거리_중위':'median_distance',
-            '이동거리_평균':'average_distance',
-        })
-        db_cols = [
-            "standard_ym",
-            "departure_station_id",
-            "departure_station_name",
-            "departure_region_code",
-            "departure_station_type",
-            "departure_grid_id",
-            "arrival_station_id",
-            "arrival_station_name",
-            "arrival_region_code",
-            "arrival_station_type",
-            "arrival_grid_id",
-            "purpose_name",
-            "daily_use_count",
-            "median_elapse_time",
-            "average_elapse_time",
-            "median_distance",
-            "average_distance",
-            "departure_station_geometry",
-            "arrival_station_geometry",
-        ]
-        df_standardized = df_standardized[db_cols]
-
-        # 7) CSV 버퍼에 WRITE 
-        csv_buffer = io.StringIO()
-        df_standardized.to_csv(csv_buffer, index=False, header=False, na_rep='\\N')
-        csv_str = csv_buffer.getvalue()
-        return csv_str
+        fs = get_s3_filesystem()
+        staging_path = f"s3://{S3_BUCKET_NAME}/{STAGING_KEY.format(ym=ym)}"
+
+        total_rows = 0
+        with fs.open(s3_parquet_path, 'rb') as src, fs.open(staging_path, 'wb') as dst:
+            parquet_file = pq.ParquetFile(src)
+            logger.info(f"Source parquet: {parquet_file.metadata.num_rows:,} rows, "
+                        f"{parquet_file.num_row_groups} row groups")
+            # 빈 배치로 출력 스키마 결정 (원본이 비어 있어도 스키마가 있는 파일 생성)
+            source_schema = pa.schema([parquet_file.schema_arrow.field(c) for c in SOURCE_COLS])
+            empty = pa.RecordBatch.from_pylist([], schema=source_schema)
+            with pq.ParquetWriter(dst, transform_batch(empty, ym, business_days).schema) as writer:
+                for batch in parquet_file.iter_batches(batch_size=COPY_BATCH_ROWS, columns=SOURCE_COLS):
+                    writer.write_batch(transform_batch(batch, ym, business_days))
+                    total_rows += batch.num_rows
+
+        # XCom에는 경로만 전달
+        logger.info(f"Staged {total_rows:,} rows to {staging_path}")
+        return staging_path
 
     @task
-    def load_to_postgres(csv_str:str, ym:str) -> None:
+    def load_to_postgres(staging_path:str, ym:str) -> None:
         """
-        `PostgresHook`을 이용해 `COPY FROM STDIN` 으로 한 번에 적재합니다.
+        스테이징 parquet을 레코드 배치 단위로 읽어 `COPY FROM STDIN`(CSV)으로 스트리밍 적재합니다.
         * 테이블이 없으면 자동 생성 (첫 실행 시 한 번만 수행)
+        * 파티션 TRUNCATE와 COPY를 한 트랜잭션으로 처리 (실패 시 기존 데이터 유지)
         """
         from airflow.providers.postgres.hooks.postgres import PostgresHook
         logger = logging.getLogger('airflow.task')
@@ -336,45 +374,38 @@ def transportation_data_postprocessing_2025():
             logger.error(f"파티션 테이블 생성 중 오류 발생: {e}")
             raise
 
-        # 기존 데이터 삭제
+        # 2) 기존 데이터 삭제 + COPY FROM STDIN 배치 적재 (한 트랜잭션)
         truncate_sql = f"""
         TRUNCATE TABLE {SCHEMA}.tb_metropolitan_work_od_{ym};
         """
+        # NULL은 따옴표 없는 빈 값 (pyarrow CSV writer 기본 표기, 빈 문자열은 "" 로 구분됨)
+        copy_sql = f"""
+        COPY {SCHEMA}.tb_metropolitan_work_od ({', '.join(DB_COLS)})
+        FROM STDIN WITH (FORMAT csv);
+        """
+        write_options = pa_csv.WriteOptions(include_header=False)
+        total_rows = 0
+        fs = get_s3_filesystem()
+        conn = pg.get_conn()
         try:
-            logger.info(f"Executing TRUNCATE TABLE for {SCHEMA}.tb_metropolitan_work_od_{ym}")
-            pg.run(truncate_sql)
+            with fs.open(staging_path, 'rb') as f, conn.cursor() as cur:
+                logger.info(f"Executing TRUNCATE TABLE for {SCHEMA}.tb_metropolitan_work_od_{ym}")
+                cur.execute(truncate_sql)
+                parquet_file = pq.ParquetFile(f)
+                for batch in parquet_file.iter_batches(batch_size=COPY_BATCH_ROWS, columns=DB_COLS):
+                    csv_buffer = io.BytesIO()
+                    pa_csv.write_csv(batch, csv_buffer, write_options)
+                    csv_buffer.seek(0)
+                    cur.copy_expert(sql=copy_sql, file=csv_buffer)
+                    total_rows += batch.num_rows
+            conn.commit()
         except Exception as e:
-            logger.error(f"기존 데이터 삭제 중 오류 발생: {e}")
+            conn.rollback()
+            logger.error(f"데이터 적재 중 오류 발생 (롤백): {e}")
             raise
-        
-        # 2) COPY FROM STDIN 으로 데이터 적재
-        copy_sql = f"""
-        COPY {SCHEMA}.tb_metropolitan_work_od (
-            standard_ym,
-            departure_station_id,
-            departure_station_name,
-            departure_region_code,
-            departure_station_type,
-            departure_grid_id,
-            arrival_station_id,
-            arrival_station_name,
-            arrival_region_code,
-            arrival_station_type,
-            arrival_grid_id,
-            purpose_name,
-            daily_use_count,
-            median_elapse_time,
-            average_elapse_time,
-            median_distance,
-            average_distance,
-            departure_station_geometry,
-            arrival_station_geometry
-        )
-        FROM STDIN WITH (FORMAT csv, NULL '\\N');
-        """
-        with pg.get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.copy_expert(sql=copy_sql, file=io.StringIO(csv_str))
+        finally:
+            conn.close()
+        logger.info(f"Loaded {total_rows:,} rows into {SCHEMA}.tb_metropolitan_work_od_{ym}")
         
 
     @task
@@ -384,11 +415,12 @@ def transportation_data_postprocessing_2025():
 
     # 워크플로우 정의
     month_list = resolve_target_months()
-    business_days = get_korean_business_day.expand(ym=month_list)
+    calendar_path = ensure_calendar(month_list)
+    business_days = get_korean_business_day.partial(calendar_path=calendar_path).expand(ym=month_list)
     
     s3_parquet_path = load_parquet_from_s3.expand(ym=month_list)
-    csv_strings = transform_parquet.expand(s3_parquet_path=s3_parquet_path, ym=month_list, business_days=business_days)
-    last_load_tasks = load_to_postgres.expand(csv_str=csv_strings, ym=month_list)
+    staging_paths = transform_parquet.expand(s3_parquet_path=s3_parquet_path, ym=month_list, business_days=business_days)
+    last_load_tasks = load_to_postgres.expand(staging_path=staging_paths, ym=month_list)
     
     last_load_tasks >> final_success()
 
@@ -1,15 +1,35 @@
-import pandas as pd
+"""
+parquet -> PostgreSQL 대용량 업로드
+- pyarrow로 row group 단위로 읽어서 COPY FROM STDIN (CSV)으로 적재 (파일 전체를 메모리에 올리지 않음)
+- --workers N: row group을 N개 연결에 나눠서 병렬 COPY
+- 스테이징 테이블에 먼저 적재한 뒤 한 트랜잭션으로 대상 테이블에 반영
+    append: INSERT INTO 대상 SELECT * FROM 스테이징
+    replace: 대상 <-> 스테이징 이름 교체 (기존 테이블 삭제)
+- 대상 테이블이 없으면 parquet 스키마로 생성
+- binary 컬럼(WKB 등)은 16진수 문자열로 변환 (geometry 컬럼은 그대로, bytea 컬럼은 \\x 접두사)
+"""
+
 from sqlalchemy import create_engine
-import time, argparse, os
+import time, argparse, os, io
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 
 load_dotenv()
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--parquet_file_path', type=str, required=True, help='업로드할 파퀘파일 경로')
 parser.add_argument('--db_server', type=str, required=True, help='업로드할 DB - 181과 AWS 중 선택')
-parser.add_argument('--schema_name', type=str, default="", help='업로드할 db의 스키마 명 설정, 미입력 시 처리하지 않음')
+parser.add_argument('--schema_name', type=str, default="", help='업로드할 db의 스키마 명 설정, 미입력 시 기본 스키마(search_path)')
 parser.add_argument('--table_name', type=str, required=True, help='업로드할 db의 테이블명 설정')
+parser.add_argument('--mode', type=str, default="append", choices=["append", "replace"],
+                    help='append: 기존 데이터에 추가, replace: 테이블 교체')
+parser.add_argument('--workers', type=int, default=1, help='병렬 COPY 연결 수 (row group 단위로 분배)')
+parser.add_argument('--batch_size', type=int, default=100_000, help='COPY 1회당 행 수')
 
 args = parser.parse_args()
 
@@ -35,47 +55,165 @@ SCHEMA_NAME=args.schema_name if args.schema_name != "" else None
 TABLE_NAME=args.table_name
 PARQUET_FILE_PATH = args.parquet_file_path
 
-print(f"[{time.strftime('%H:%M:%S')}] Parquet 파일 로드 시작...")
+TARGET = f'"{SCHEMA_NAME}"."{TABLE_NAME}"' if SCHEMA_NAME else f'"{TABLE_NAME}"'
+STAGING_NAME = f"{TABLE_NAME}_staging"
+STAGING = f'"{SCHEMA_NAME}"."{STAGING_NAME}"' if SCHEMA_NAME else f'"{STAGING_NAME}"'
+
+# binary -> 16진수 변환표
+HEX_TABLE = np.array([f'{i:02x}'.encode() for i in range(256)], dtype='S2')
+
+def pg_type(arrow_type: pa.DataType) -> str:
+    "대상 테이블 자동 생성용 arrow -> PostgreSQL 타입"
+    if pa.types.is_boolean(arrow_type):
+        return "BOOLEAN"
+    if pa.types.is_int8(arrow_type) or pa.types.is_int16(arrow_type) or pa.types.is_uint8(arrow_type):
+        return "SMALLINT"
+    if pa.types.is_int32(arrow_type) or pa.types.is_uint16(arrow_type):
+        return "INTEGER"
+    if pa.types.is_integer(arrow_type):
+        return "BIGINT"
+    if pa.types.is_floating(arrow_type):
+        return "DOUBLE PRECISION"
+    if pa.types.is_decimal(arrow_type):
+        return f"NUMERIC({arrow_type.precision},{arrow_type.scale})"
+    if pa.types.is_timestamp(arrow_type):
+        return "TIMESTAMPTZ" if arrow_type.tz else "TIMESTAMP"
+    if pa.types.is_date(arrow_type):
+        return "DATE"
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return "BYTEA"
+    return "TEXT"
+
+def hex_binary(arr: pa.Array, prefix: str = "") -> pa.Array:
+    "binary 배열 -> 16진수 문자열 배열 (행 단위 변환 없이 버퍼 일괄 변환)"
+    arr = arr.cast(pa.binary())
+    offsets = np.frombuffer(arr.buffers()[1], dtype=np.int32)[arr.offset:arr.offset + len(arr) + 1]
+    data = np.frombuffer(arr.buffers()[2], dtype=np.uint8) if arr.buffers()[2] is not None else np.zeros(0, np.uint8)
+    hexed = HEX_TABLE[data[offsets[0]:offsets[-1]]]
+    hex_str = pa.Array.from_buffers(pa.string(), len(arr),
+                                    [None, pa.py_buffer((offsets - offsets[0]) * 2), pa.py_buffer(hexed.tobytes())])
+    if prefix:
+        hex_str = pc.binary_join_element_wise(prefix, hex_str, '')
+    return pc.if_else(arr.is_valid(), hex_str, pa.scalar(None, pa.string()))
+
+def to_csv_batch(batch: pa.RecordBatch, bytea_cols: set) -> io.BytesIO:
+    "레코드 배치 -> COPY용 CSV 버퍼 (NULL은 따옴표 없는 빈 값)"
+    columns = []
+    for name, col in zip(batch.schema.names, batch.columns):
+        if pa.types.is_binary(col.type) or pa.types.is_large_binary(col.type):
+            col = hex_binary(col, "\\x" if name in bytea_cols else "")
+        columns.append(col)
+    buffer = io.BytesIO()
+    pa_csv.write_csv(pa.RecordBatch.from_arrays(columns, names=batch.schema.names), buffer,
+                     pa_csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    return buffer
+
+def copy_row_groups(worker_id: int, row_groups: list[int], columns: list[str], bytea_cols: set) -> int:
+    "워커 1개: 자기 연결로 배정된 row group을 스테이징 테이블에 COPY"
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    copy_sql = f"COPY {STAGING} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+    parquet_file = pq.ParquetFile(PARQUET_FILE_PATH)
+    conn = engine.raw_connection()
+    rows = 0
+    try:
+        with conn.cursor() as cur:
+            for batch in parquet_file.iter_batches(batch_size=args.batch_size, row_groups=row_groups,
+                                                   columns=columns):
+                cur.copy_expert(sql=copy_sql, file=to_csv_batch(batch, bytea_cols))
+                rows += batch.num_rows
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"[{time.strftime('%H:%M:%S')}] worker {worker_id}: {len(row_groups)} row groups, {rows:,} rows")
+    return rows
+
+# 1. Parquet 메타데이터 확인 (데이터는 COPY 시 row group 단위로 읽음)
+print(f"[{time.strftime('%H:%M:%S')}] Parquet 파일 확인...")
 try:
-    df = pd.read_parquet(PARQUET_FILE_PATH)
-    print(f"총 {len(df)} 건의 데이터 로드 완료.")
+    parquet_file = pq.ParquetFile(PARQUET_FILE_PATH)
+    arrow_schema = parquet_file.schema_arrow
+    num_row_groups = parquet_file.num_row_groups
+    print(f"총 {parquet_file.metadata.num_rows:,} 건, row group {num_row_groups}개")
 except Exception as e:
     print(f"Parquet 파일 로드 오류: {e}")
     exit()
 
-# 2. SQLAlchemy 엔진 연결
+# 2. SQLAlchemy 엔진 연결 (COPY는 raw psycopg2 연결 사용)
 DB_URL = f"postgresql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}"
 
 try:
-    engine = create_engine(DB_URL)
+    engine = create_engine(DB_URL, pool_size=max(args.workers, 5))
     print(f"[{time.strftime('%H:%M:%S')}] DB 연결 엔진 생성 완료.")
 except Exception as e:
     print(f"DB 연결 엔진 생성 오류. 설정 정보를 확인하세요: {e}")
     exit()
 
-# 3. DB 삽입
-print(f"[{time.strftime('%H:%M:%S')}] 데이터베이스 삽입 시작...")
+def run_sql(sql: str, params=None, fetch: bool = False):
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            result = cur.fetchall() if fetch else None
+        conn.commit()
+        return result
+    finally:
+        conn.close()
+
+# 3. DB 삽입: 스테이징 테이블에 병렬 COPY -> 한 트랜잭션으로 대상 테이블 반영
+print(f"[{time.strftime('%H:%M:%S')}] 데이터베이스 삽입 시작... (mode={args.mode}, workers={args.workers})")
 
 try:
-    # if_exists='append'/'replace'
-    # index=False: 데이터프레임의 인덱스는 테이블에 컬럼으로 저장하지 않음
-    if SCHEMA_NAME:
-        df.to_sql(
-            schema=SCHEMA_NAME,
-            name=TABLE_NAME,
-            con=engine,
-            if_exists='append',
-            index=False,
-            chunksize=10000  # 대용량 데이터 전송 시 청크 사이즈를 설정하면 안정성 증가
-        )
-
-        print(f"[{time.strftime('%H:%M:%S')}] ⭐ 총 {len(df)} 건의 데이터가 {args.db_server} 서버에 성공적으로 업로드되었습니다! ⭐")
+    target_exists = run_sql("SELECT to_regclass(%s) IS NOT NULL", (TARGET,), fetch=True)[0][0]
+    if not target_exists:
+        column_defs = ", ".join(f'"{f.name}" {pg_type(f.type)}' for f in arrow_schema)
+        run_sql(f"CREATE TABLE {TARGET} ({column_defs})")
+        print(f"[{time.strftime('%H:%M:%S')}] 대상 테이블 생성: {TARGET}")
+
+    run_sql(f"DROP TABLE IF EXISTS {STAGING}")
+    # replace는 교체 후 대상 테이블이 되므로 제약조건/인덱스까지 복사
+    like_option = "INCLUDING DEFAULTS" if args.mode == "append" else "INCLUDING ALL"
+    run_sql(f"CREATE TABLE {STAGING} (LIKE {TARGET} {like_option})")
+    bytea_cols = {row[0] for row in run_sql(
+        "SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(%s) AND atttypid = 'bytea'::regtype",
+        (STAGING,), fetch=True)}
+
+    start = time.time()
+    columns = arrow_schema.names
+    workers = max(1, min(args.workers, num_row_groups))
+    assignments = [list(range(w, num_row_groups, workers)) for w in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(copy_row_groups, w, row_groups, columns, bytea_cols)
+                   for w, row_groups in enumerate(assignments)]
+        total_rows = sum(f.result() for f in futures)
+    elapsed = time.time() - start
+    print(f"[{time.strftime('%H:%M:%S')}] 스테이징 COPY 완료: {total_rows:,} 건, "
+          f"{elapsed:.1f}s ({total_rows / max(elapsed, 1e-9):,.0f} rows/sec)")
+
+    # 4. 대상 테이블 반영 (한 트랜잭션)
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    if args.mode == "append":
+        swap_sql = f"""
+            INSERT INTO {TARGET} ({column_list}) SELECT {column_list} FROM {STAGING};
+            DROP TABLE {STAGING};
+        """
+    else:
+        swap_sql = f"""
+            ALTER TABLE {TARGET} RENAME TO "{TABLE_NAME}_old";
+            ALTER TABLE {STAGING} RENAME TO "{TABLE_NAME}";
+            DROP TABLE {f'"{SCHEMA_NAME}".' if SCHEMA_NAME else ''}"{TABLE_NAME}_old";
+        """
+    run_sql(swap_sql)
+
+    elapsed = time.time() - start
+    print(f"[{time.strftime('%H:%M:%S')}] ⭐ 총 {total_rows:,} 건의 데이터가 {args.db_server} 서버에 성공적으로 업로드되었습니다! "
+          f"({elapsed:.1f}s, {total_rows / max(elapsed, 1e-9):,.0f} rows/sec) ⭐")
 
 except Exception as e:
     print("-----------------------------------------------------")
-    print("데이터 삽입 중 심각한 오류 발생. 상세 정보 확인 필요.")
-    print(f"SQLAlchemy 오류: {e}")
-    if hasattr(e, 'orig') and hasattr(e.orig, 'pgerror'):
+    print("데이터 삽입 중 심각한 오류 발생. 상세 정보 확인 필요. (대상 테이블은 변경되지 않음)")
+    print(f"오류: {e}")
+    if hasattr(e, 'pgerror') and e.pgerror:
         # Psycopg2 (PostgreSQL)의 원본 오류 메시지 출력
-        print(f"PostgreSQL 원본 오류: {e.orig.pgerror}")
-    print("-----------------------------------------------------")
\ No newline at end of file
+        print(f"PostgreSQL 원본 오류: {e.pgerror}")
+    print("-----------------------------------------------------")
@@ -0,0 +1,96 @@
+"""
+한국 영업일 달력 (날짜 차원 테이블)
+holidays 라이브러리로 여러 해의 날짜 테이블을 1회 생성하여 parquet으로 저장
+- 파이프라인(step1 영업일 컬럼)과 Airflow DAG(월 영업일 수)가 같은 달력을 조회
+- 필요한 연도가 파일에 없을 때만 다시 생성
+- DAG는 calendar_table만 가져다 쓰므로 config는 함수 안에서 import (DAG 폴더에 config.py 불필요)
+
+[컬럼] 날짜 순 정렬
+date: DATE
+ymd: yyyymmdd 정수 (운행일자와 같은 형식)
+year_month: 'YYYYMM'
+weekday: 요일 (DuckDB dayofweek 기준, 일:0 ~ 토:6)
+is_holiday, holiday_name: 한국 공휴일 여부, 명칭
+is_business_day: 평일이면서 공휴일이 아닌 날
+business_days_in_month: 해당 월 영업일 수
+"""
+
+import os, argparse
+from pathlib import Path
+import pandas as pd
+import pyarrow.parquet as pq
+
+def calendar_path():
+    from config import CONFIG
+    return CONFIG['CALENDAR_PATH']
+
+def calendar_table(years):
+    "연도 목록(빈 연도는 채움)의 날짜 차원 DataFrame"
+    import holidays
+    years = sorted(set(int(y) for y in years))
+    kr_holidays = holidays.SouthKorea(years=years)
+
+    dates = pd.date_range(f'{years[0]}-01-01', f'{years[-1]}-12-31', freq='D')
+    cal = pd.DataFrame({'date': dates.date})
+    cal['ymd'] = (dates.year * 10000 + dates.month * 100 + dates.day).astype('int64')
+    cal['year_month'] = dates.strftime('%Y%m')
+    cal['weekday'] = ((dates.weekday + 1) % 7).astype('int8')     # 월:0 -> 일:0 기준으로
+    cal['holiday_name'] = [kr_holidays.get(d) for d in cal['date']]
+    cal['is_holiday'] = cal['holiday_name'].notna()
+    cal['is_business_day'] = ~cal['weekday'].isin([0, 6]) & ~cal['is_holiday']
+    cal['business_days_in_month'] = (cal.groupby('year_month')['is_business_day']
+                                     .transform('sum').astype('int16'))
+    return cal[['date', 'ymd', 'year_month', 'weekday', 'is_holiday', 'holiday_name',
+                 'is_business_day', 'business_days_in_month']]
+
+def build_calendar(years, path=None):
+    """
+    연도 목록의 날짜 차원 테이블 생성 후 parquet 저장
+    반환: parquet 경로
+    """
+    path = path or calendar_path()
+    cal = calendar_table(years)
+    years = sorted(set(int(y) for y in years))
+
+    os.makedirs(Path(path).parent, exist_ok=True)
+    cal.to_parquet(path + '.tmp', index=False, compression='zstd')
+    os.replace(path + '.tmp', path)
+    print(f"    [SUC] calendar built: {years[0]}~{years[-1]} ({len(cal):,} days) -> {path}")
+    return path
+
+def _covered_years(path):
+    "parquet 통계(min/max ymd)로 파일이 포함하는 연도 범위 확인 (데이터 스캔 없음)"
+    meta = pq.read_metadata(path)
+    col = meta.schema.to_arrow_schema().get_field_index('ymd')
+    stats = [meta.row_group(i).column(col).statistics for i in range(meta.num_row_groups)]
+    return min(s.min for s in stats) // 10000, max(s.max for s in stats) // 10000
+
+def ensure_calendar(years=None):
+    """
+    필요한 연도를 모두 포함하는 달력 parquet 경로 (없거나 범위가 부족하면 재생성)
+    years: 필요한 연도 목록 (기본: CONFIG['CALENDAR_YEARS'] 범위)
+    """
+    from config import CONFIG
+    start, end = CONFIG['CALENDAR_YEARS']
+    years = set(int(y) for y in years) if years else set()
+    path = calendar_path()
+    if Path(path).exists():
+        lo, hi = _covered_years(path)
+        if all(lo <= y <= hi for y in years):
+            return path
+        start, end = min(start, lo), max(end, hi)
+    return build_calendar(range(min([start, *years]), max([end, *years]) + 1), path)
+
+def load_calendar_sql(years=None):
+    "FROM 절에 바로 쓰는 달력 read_parquet SQL"
+    return f"read_parquet('{ensure_calendar(years)}')"
+
+if __name__ == '__main__':
+    from config import CONFIG
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--start_year", type=int, default=CONFIG['CALENDAR_YEARS'][0])
+    ap.add_argument("--end_year", type=int, default=CONFIG['CALENDAR_YEARS'][1])
+    ap.add_argument("--output", default=None, help="저장 경로 (기본: CONFIG['CALENDAR_PATH'], DAG용 S3 업로드 원본)")
+    args = ap.parse_args()
+
+    build_calendar(range(args.start_year, args.end_year + 1), args.output)
@@ -0,0 +1,185 @@
+"""
+월별 카드 활동 인덱스
+보정된 주거지/직장지 윈도우 테이블을 월별로 1회만 집계하여 card_key 위치에 값을 둔 numpy 벡터(.npy)로 저장
+- 월 범위 합계/임계값 비교가 배열 연산이라서, 월 범위나 최소 횟수를 바꿔도 통행 데이터를 다시 읽지 않음
+- card_key는 카드 사전의 0부터 빈 번호 없는 키 -> 벡터 인덱스 = card_key
+- 사전이 늘어나면 읽을 때 0으로 채워 길이를 맞춤
+
+[파일] {CARD_INDEX_DIR}/{month}/{month}_{window}_{trips|stops}.npy (uint32)
+trips: 카드별 해당 월 윈도우 통행 수
+stops: 카드별 해당 월 윈도우 정류장(좌표) 수 (step5가 클러스터링하는 점 수)
+- 윈도우 테이블이 인덱스보다 새로우면 해당 월만 다시 생성
+- 생성 시점 카드 사전 행 수/해시를 {month}_{window}_meta.json에 기록하고, 사전이 다시 만들어지거나
+  키 순서가 바뀌면(기록한 행 수까지의 해시가 다르면) 다시 생성
+"""
+
+import os, argparse, time, json
+from glob import glob
+from pathlib import Path
+import duckdb
+import numpy as np
+import pyarrow.parquet as pq
+
+from config import CONFIG
+from utils import between_months
+
+WINDOWS = ['residence', 'office']
+
+def window_table_path(month, window):
+    return f"{CONFIG['DATA_DIR']}/{month}/{month}_{window}_windowed_transport_corrected.parquet"
+
+def index_path(month, window, kind):
+    return f"{CONFIG['CARD_INDEX_DIR']}/{month}/{month}_{window}_{kind}.npy"
+
+def meta_path(month, window):
+    return f"{CONFIG['CARD_INDEX_DIR']}/{month}/{month}_{window}_meta.json"
+
+def available_months():
+    "주거지/직장지 보정 윈도우 테이블이 모두 있는 월"
+    months = []
+    for path in sorted(glob(f"{CONFIG['DATA_DIR']}/*/*_residence_windowed_transport_corrected.parquet")):
+        month = Path(path).parent.name
+        if Path(window_table_path(month, 'office')).exists():
+            months.append(month)
+    return months
+
+def num_cards():
+    "카드 사전 크기 (parquet 메타데이터 행 수)"
+    return pq.read_metadata(CONFIG['CARD_DICT_PATH']).num_rows
+
+_dict_hashes = {}
+
+def card_dict_hash(con, rows):
+    """
+    카드 사전 앞 rows개 키의 (card_key, 가상카드번호) 해시 (사전 파일/행 수별 캐시)
+    다중 인자 hash()는 XOR 합에서 키 교환이 상쇄되므로 키와 번호를 한 문자열로 묶어서 해시
+    """
+    path = CONFIG['CARD_DICT_PATH']
+    cache_key = (os.path.getmtime(path), rows)
+    if cache_key not in _dict_hashes:
+        _dict_hashes[cache_key] = str(con.execute(f"""
+            SELECT COALESCE(bit_xor(hash(card_key::VARCHAR || ':' || 가상카드번호)), 0)
+            FROM read_parquet('{path}')
+            WHERE card_key < {rows}
+        """).fetchone()[0])
+    return _dict_hashes[cache_key]
+
+def _save(path, arr):
+    os.makedirs(Path(path).parent, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, arr)
+    os.replace(path + '.tmp', path)
+
+def _is_current(con, month, window):
+    "인덱스가 윈도우 테이블보다 새롭고, 생성 시점 카드 사전이 현재 사전의 앞부분과 같은지"
+    src = os.path.getmtime(window_table_path(month, window))
+    if not (Path(meta_path(month, window)).exists()
+            and all(Path(index_path(month, window, kind)).exists()
+                    and os.path.getmtime(index_path(month, window, kind)) >= src for kind in ['trips', 'stops'])):
+        return False
+    with open(meta_path(month, window)) as f:
+        meta = json.load(f)
+    return (meta['card_dict_rows'] <= num_cards()
+            and meta['card_dict_hash'] == card_dict_hash(con, meta['card_dict_rows']))
+
+def build_month_index(con, month, force=False):
+    "월별 주거지/직장지 카드 활동 벡터 생성 (최신이면 건너뜀), 반환: 새로 만든 윈도우 수"
+    built = 0
+    n = num_cards()
+    for window in WINDOWS:
+        if not force and _is_current(con, month, window):
+            continue
+        counts = con.execute(f"""
+            SELECT card_key
+                , COUNT(*) AS trips
+                , COUNT(DISTINCT (station_key, x_5179, y_5179)) AS stops
+            FROM read_parquet('{window_table_path(month, window)}')
+            WHERE card_key IS NOT NULL
+            GROUP BY card_key
+        """).fetchnumpy()
+        for kind in ['trips', 'stops']:
+            arr = np.zeros(n, dtype=np.uint32)
+            arr[counts['card_key']] = counts[kind]
+            _save(index_path(month, window, kind), arr)
+        with open(meta_path(month, window) + '.tmp', 'w') as f:
+            json.dump({'card_dict_rows': n, 'card_dict_hash': card_dict_hash(con, n)}, f)
+        os.replace(meta_path(month, window) + '.tmp', meta_path(month, window))
+        built += 1
+    return built
+
+def ensure_index(con, months):
+    "월 목록의 인덱스가 모두 최신이 되도록 필요한 월만 생성"
+    for month in months:
+        if build_month_index(con, month):
+            print(f"    [SUC] {month} card index built")
+
+def load_vector(month, window, kind, n=None):
+    "월/윈도우 벡터 (길이 n으로 0 채움)"
+    arr = np.load(index_path(month, window, kind), mmap_mode='r')
+    n = len(arr) if n is None else n
+    out = np.zeros(n, dtype=np.uint32)
+    out[:min(len(arr), n)] = arr[:n]
+    return out
+
+def window_trips(months, window, n=None):
+    "월 범위 카드별 통행 수 합계 (uint64, 인덱스 = card_key)"
+    n = num_cards() if n is None else n
+    total = np.zeros(n, dtype=np.uint64)
+    for month in months:
+        total += load_vector(month, window, 'trips', n)
+    return total
+
+def window_stops(months, window, n=None):
+    """
+    월 범위 카드별 정류장 수 추정 (월별 정류장 수의 최댓값)
+    같은 정류장을 반복 이용하는 카드는 월이 늘어도 정류장 수가 거의 그대로라 최댓값으로 근사
+    """
+    n = num_cards() if n is None else n
+    stops = np.zeros(n, dtype=np.uint32)
+    for month in months:
+        np.maximum(stops, load_vector(month, window, 'stops', n), out=stops)
+    return stops
+
+def valid_card_mask(months, min_trips=None, n=None):
+    "주거지/직장지 통행이 모두 min_trips회 이상인 카드 boolean 마스크 (인덱스 = card_key)"
+    min_trips = CONFIG['MIN_WINDOW_TRIPS'] if min_trips is None else min_trips
+    n = num_cards() if n is None else n
+    return ((window_trips(months, 'residence', n) >= min_trips)
+            & (window_trips(months, 'office', n) >= min_trips))
+
+def valid_card_keys(months, min_trips=None):
+    "유효 카드 card_key 배열 (오름차순)"
+    return np.flatnonzero(valid_card_mask(months, min_trips)).astype(np.int64)
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--start", default=None, help="시작 월 YYYYMM (기본: 인덱스 가능한 첫 월)")
+    ap.add_argument("--end", default=None, help="끝 월 YYYYMM (기본: 인덱스 가능한 마지막 월)")
+    ap.add_argument("--min_trips", type=int, nargs='+', default=[CONFIG['MIN_WINDOW_TRIPS']],
+                    help="주거지/직장지 윈도우 최소 통행 수 (여러 개 지정 시 각각 집계)")
+    ap.add_argument("--rebuild", action='store_true', help="인덱스 전체 재생성")
+    args = ap.parse_args()
+
+    months = available_months()
+    if args.start or args.end:
+        months = [m for m in between_months(int(args.start or months[0]), int(args.end or months[-1]))
+                  if m in months]
+    if not months:
+        print("    [SKIP] no windowed tables to index")
+        raise SystemExit
+
+    con = duckdb.connect()
+    t0 = time.time()
+    for month in months:
+        if build_month_index(con, month, force=args.rebuild):
+            print(f"    [SUC] {month} card index built")
+    con.close()
+    print(f"index ready: {len(months)} months, elapsed time: {time.time()-t0:.1f}s")
+
+    t0 = time.time()
+    n = num_cards()
+    home, work = window_trips(months, 'residence', n), window_trips(months, 'office', n)
+    for min_trips in args.min_trips:
+        count = int(((home >= min_trips) & (work >= min_trips)).sum())
+        print(f"{months[0]}~{months[-1]} min_trips={min_trips}: {count:,} valid cards")
+    print(f"elapsed time: {time.time()-t0:.2f}s")
@@ -0,0 +1,221 @@
+"""
+배치 단위 DBSCAN 엔진
+카드별 for문 + sklearn DBSCAN 대신, 배치 전체를 한 번에 5179로 변환하고
+카드별로 정렬된 공유 배열의 연속 구간에서 반경 이웃/연결요소를 계산함
+
+[메인 클러스터 규칙 - 기존 sklearn 경로와 동일]
+- 점이 DBSCAN_MIN_SAMPLES 미만인 카드, 좌표 변환 결과가 유한하지 않은 카드는 제외
+- core: 반경 eps 이내(자기 자신 포함) 이웃의 가중치 합 >= min_samples
+- 클러스터 번호: 카드 내에서 가장 먼저 등장하는 core 점 순서
+- border: 인접한 core 중 가장 작은 번호의 클러스터에 소속
+- 메인 클러스터: 크기가 가장 큰 클러스터 (동률이면 작은 번호)
+- confidence = round(메인 클러스터 크기 / 유효 점 수, 2)
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from utils import to_5179
+
+# 한 번에 계산할 카드 묶음/거리 행렬 타일의 최대 점 쌍 수 (메모리 상한)
+PAIR_BUDGET = 20_000_000
+
+def _radius_pairs(x, y, eps):
+    """
+    단일 카드 구간의 반경 이웃 쌍 (자기 자신 포함, 거리 <= eps)
+    점 수가 많은 카드는 행 블록 단위로 나눠 거리 행렬 크기를 PAIR_BUDGET 이하로 유지
+    """
+    n = len(x)
+    step = max(1, PAIR_BUDGET // max(n, 1))
+    rows, cols = [], []
+    for r0 in range(0, n, step):
+        dx = x[r0:r0 + step, None] - x[None, :]
+        dy = y[r0:r0 + step, None] - y[None, :]
+        r, c = np.nonzero(dx * dx + dy * dy <= eps * eps)
+        rows.append(r + r0)
+        cols.append(c)
+    if not rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+def _cluster_group(x, y, w, starts, ends, eps, min_samples):
+    """
+    카드 묶음(연속 구간들)에 대해 점별 클러스터 번호 계산
+    반환: labels (점별 연결요소 id, 노이즈 -1), first (연결요소 id -> 첫 core 위치)
+    """
+    n = len(x)
+    rows, cols = [], []
+    for s, e in zip(starts, ends):
+        r, c = _radius_pairs(x[s:e], y[s:e], eps)
+        rows.append(r + s)
+        cols.append(c + s)
+    rows = np.concatenate(rows).astype(np.int64)
+    cols = np.concatenate(cols).astype(np.int64)
+
+    # 1) core 판정: 이웃 가중치 합
+    core = np.bincount(rows, weights=w[cols], minlength=n) >= min_samples
+
+    # 2) core-core 연결요소 = 클러스터
+    cc = core[rows] & core[cols]
+    graph = coo_matrix((np.ones(cc.sum(), dtype=np.int8), (rows[cc], cols[cc])), shape=(n, n)).tocsr()
+    _, comp = connected_components(graph, directed=False)
+
+    labels = np.full(n, -1, dtype=np.int64)
+    labels[core] = comp[core]
+
+    # 3) border: 인접 core 중 가장 먼저 등장한(번호가 작은) 클러스터
+    # 연결요소 id -> 해당 요소의 첫 core 인덱스
+    first = np.full(comp.max() + 1 if n else 0, n, dtype=np.int64)
+    core_idx = np.flatnonzero(core)
+    np.minimum.at(first, comp[core_idx], core_idx)
+
+    be = ~core[rows] & core[cols]
+    if be.any():
+        cand = np.full(n, n, dtype=np.int64)
+        np.minimum.at(cand, rows[be], first[comp[cols[be]]])
+        border = cand < n
+        labels[border] = comp[cand[border]]
+
+    return labels, first
+
+def find_main_clusters(cards, lon, lat, eps, min_samples, weight=None, projected=False):
+    """
+    배치 전체 점에 대해 카드별 DBSCAN 메인 클러스터 산출
+
+    cards: 카드번호 배열, lon/lat: EPSG:4326 좌표 (NaN 허용)
+    weight: 점별 반복 횟수 (None이면 1)
+    projected: lon/lat이 이미 EPSG:5179 좌표이면 True (정류장 카탈로그 사용 시)
+    반환:
+      in_main: 입력 행과 같은 길이의 메인 클러스터 소속 여부
+      stats: card, trips, cluster_size, confidence (메인 클러스터가 있는 카드만)
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    n = len(lon)
+    w = np.ones(n) if weight is None else np.asarray(weight, dtype=float)
+
+    codes, uniques = pd.factorize(np.asarray(cards), sort=False)
+    n_cards = len(uniques)
+
+    # 1) 좌표 변환 1회 (NaN 제외)
+    has_xy = ~(np.isnan(lon) | np.isnan(lat))
+    if projected:
+        x, y = lon, lat
+    else:
+        x = np.full(n, np.nan)
+        y = np.full(n, np.nan)
+        x[has_xy], y[has_xy] = to_5179(lon[has_xy], lat[has_xy])
+
+    # 2) 대상 카드: 원본 점 수 >= min_samples, 변환 결과가 모두 유한
+    raw_cnt = np.bincount(codes, weights=w, minlength=n_cards)
+    bad = np.bincount(codes, weights=(has_xy & ~(np.isfinite(x) & np.isfinite(y))), minlength=n_cards) > 0
+    trips = np.bincount(codes, weights=w * has_xy, minlength=n_cards)
+    eligible = (raw_cnt >= min_samples) & ~bad & (trips > 0)
+
+    # 3) 카드별 연속 구간으로 정렬
+    idx = np.flatnonzero(has_xy & eligible[codes])
+    idx = idx[np.argsort(codes[idx], kind='stable')]
+    sc = codes[idx]
+    sx, sy, sw = x[idx], y[idx], w[idx]
+    bounds = np.flatnonzero(np.diff(sc)) + 1
+    starts = np.concatenate([[0], bounds]) if len(idx) else np.array([], dtype=np.int64)
+    ends = np.concatenate([bounds, [len(idx)]]) if len(idx) else np.array([], dtype=np.int64)
+
+    # 4) 점 쌍 수 기준으로 카드 묶음을 나눠서 클러스터링
+    first = np.full(len(idx), -1, dtype=np.int64)   # 점별 소속 클러스터의 첫 core 위치
+    sizes = (ends - starts) ** 2
+    g0 = 0
+    while g0 < len(starts):
+        g1 = g0 + max(1, np.searchsorted(np.cumsum(sizes[g0:]), PAIR_BUDGET, side='right'))
+        s, e = starts[g0], ends[g1 - 1]
+        lab, fst = _cluster_group(sx[s:e], sy[s:e], sw[s:e], starts[g0:g1] - s, ends[g0:g1] - s,
+                                  eps, min_samples)
+        hit = lab >= 0
+        first[s:e][hit] = fst[lab[hit]] + s
+        g0 = g1
+
+    # 5) 카드별 메인 클러스터: 가중 크기 최대, 동률이면 먼저 등장한 클러스터
+    clustered = first >= 0
+    if not clustered.any():
+        return np.zeros(n, dtype=bool), pd.DataFrame(columns=['card', 'trips', 'cluster_size', 'confidence'])
+    cl_first, cl_inv = np.unique(first[clustered], return_inverse=True)
+    cl_size = np.bincount(cl_inv, weights=sw[clustered])
+    cl_card = sc[cl_first]
+    pick = np.lexsort((cl_first, -cl_size, cl_card))
+    main = pick[np.r_[True, np.diff(cl_card[pick]) != 0]]
+
+    is_main = np.zeros(len(cl_first), dtype=bool)
+    is_main[main] = True
+    in_main_sorted = np.zeros(len(idx), dtype=bool)
+    in_main_sorted[clustered] = is_main[cl_inv]
+
+    in_main = np.zeros(n, dtype=bool)
+    in_main[idx] = in_main_sorted
+
+    main_card = cl_card[main]
+    stats = pd.DataFrame({
+        'card': uniques[main_card],
+        'trips': trips[main_card].astype(np.int64),
+        'cluster_size': cl_size[main].astype(np.int64),
+        'confidence': np.round(cl_size[main] / trips[main_card], 2),
+    })
+    # 입력 첫 등장 순서 유지
+    stats = stats.iloc[np.argsort(main_card, kind='stable')].reset_index(drop=True)
+    return in_main, stats
+
+def sklearn_main_clusters(cards, lon, lat, eps, min_samples, projected=False):
+    """
+    기존 카드별 sklearn 경로 (검증용 기준 구현)
+    반환 형식은 find_main_clusters와 동일
+    """
+    from sklearn.cluster import DBSCAN
+
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    in_main = np.zeros(len(lon), dtype=bool)
+    rows = []
+    for card, pos in pd.Series(np.arange(len(lon))).groupby(np.asarray(cards), sort=False):
+        pos = pos.to_numpy()
+        if len(pos) < min_samples:
+            continue
+        pos = pos[~(np.isnan(lon[pos]) | np.isnan(lat[pos]))]
+        if len(pos) == 0:
+            continue
+        x, y = (lon[pos], lat[pos]) if projected else to_5179(lon[pos], lat[pos])
+        if not (np.isfinite(x).all() and np.isfinite(y).all()):
+            continue
+        labels = DBSCAN(eps=eps, min_samples=min_samples).fit(np.column_stack([x, y])).labels_
+        if len(labels[labels >= 0]) == 0:
+            continue
+        unique_labels, counts = np.unique(labels[labels >= 0], return_counts=True)
+        cluster_mask = labels == unique_labels[np.argmax(counts)]
+        in_main[pos[cluster_mask]] = True
+        cluster_size = np.sum(cluster_mask)
+        rows.append({'card': card, 'trips': len(pos), 'cluster_size': cluster_size,
+                     'confidence': round(cluster_size / len(pos), 2)})
+    return in_main, pd.DataFrame(rows, columns=['card', 'trips', 'cluster_size', 'confidence'])
+
+def check_parity(cards, lon, lat, eps, min_samples, weight=None, projected=False):
+    """
+    배치 엔진과 sklearn 경로의 결과 비교
+    weight가 있으면 엔진은 묶인 점에 가중치로, sklearn은 반복 횟수만큼 펼친 점으로 계산
+    반환: 불일치 카드 수 (0이면 동일)
+    """
+    cards = np.asarray(cards)
+    in_main_a, stats_a = find_main_clusters(cards, lon, lat, eps, min_samples, weight, projected)
+    if weight is not None:
+        rep = np.repeat(np.arange(len(cards)), np.asarray(weight, dtype=np.int64))
+        cards, lon, lat = cards[rep], np.asarray(lon)[rep], np.asarray(lat)[rep]
+        in_main_a = in_main_a[rep]
+    in_main_b, stats_b = sklearn_main_clusters(cards, lon, lat, eps, min_samples, projected)
+
+    a = stats_a.set_index('card')
+    b = stats_b.set_index('card')
+    diff = set(a.index) ^ set(b.index)
+    common = a.index.intersection(b.index)
+    diff |= set(common[(a.loc[common, 'cluster_size'].to_numpy() != b.loc[common, 'cluster_size'].to_numpy())
+                       | (a.loc[common, 'confidence'].to_numpy() != b.loc[common, 'confidence'].to_numpy())])
+    diff |= set(pd.unique(cards[in_main_a != in_main_b]))
+    return len(diff)
@@ -0,0 +1,151 @@
+"""
+월별 출퇴근 통행 추출 (step7 통계, step8 집계 공용)
+월별 목적통행 테이블에 카드별 직주 정류장을 1회 조인하여 출근(morning)/퇴근(evening) 통행만
+카드번호 순 parquet으로 저장, 건수는 parquet 메타데이터(KV_METADATA)에 기록
+
+[판정]
+1) 출근: 주거지 정류장 승차 -> 직장지 정류장 하차, 승/하차 모두 오전 윈도우
+2) 퇴근: 직장지 정류장 승차 -> 주거지 정류장 하차, 승/하차 모두 오후 윈도우
+- 주거지/직장지는 매핑 결과 중 confidence >= MIN_CONFIDENCE 정류장
+- 정류장 비교는 정류장 사전 station_key로 (정류장ID, 지역코드, 교통수단구분을 비트로 묶지 않음)
+- 매핑 파일, 월별 목적통행 파일, 카드/정류장 사전, 신뢰도, 윈도우 설정이 바뀌면 다시 생성
+"""
+
+import os, json
+from pathlib import Path
+import pyarrow.parquet as pq
+
+from config import CONFIG
+from utils import trip_window_sql, card_dict_sql, station_dict_sql
+
+def mapping_path():
+    return f"{CONFIG['OUTPUT_DIR']}/card_id_work_od_mapping.parquet"
+
+def purpose_path(month):
+    return f'output/purpose_transport/{month}/{month}_purpose_transport.parquet'
+
+def commute_trips_path(month):
+    return f'output/purpose_transport/commute_trips/{month}/{month}_commute_trips.parquet'
+
+def _source_fingerprint(month):
+    "매핑 파일 + 월별 목적통행 파일 + 카드/정류장 사전 + 판정 설정 (메타데이터에 기록하여 재사용 여부 판단)"
+    inputs = {'mapping': mapping_path(), 'purpose': purpose_path(month),
+              'card_dict': CONFIG['CARD_DICT_PATH'], 'station_dict': CONFIG['STATION_DICT_PATH']}
+    stats = {name: os.stat(path) for name, path in inputs.items()}
+    return json.dumps({'version': 4,
+                       **{f'{name}_size': stat.st_size for name, stat in stats.items()},
+                       **{f'{name}_mtime': stat.st_mtime for name, stat in stats.items()},
+                       'min_confidence': CONFIG['MIN_CONFIDENCE'],
+                       'morning': list(CONFIG['MORNING_WINDOW']), 'evening': list(CONFIG['EVENING_WINDOW'])})
+
+def read_commute_counts(path):
+    "parquet 메타데이터의 통행 수/카드 수 (파일 스캔 없음)"
+    meta = pq.read_metadata(path).metadata or {}
+    return {k: int(meta[k.encode()]) for k in ['monthly_od_cnt', 'monthly_od_card_cnt']}
+
+def _is_current(path, fingerprint):
+    if not Path(path).exists():
+        return False
+    meta = pq.read_metadata(path).metadata or {}
+    return meta.get(b'source') == fingerprint.encode()
+
+def build_home_work_lookup(con):
+    """
+    카드별 주거지/직장지 정류장 (card_key, stop_key, role) 임시 테이블
+    (신뢰도 필터, card_id -> card_key, 정류장 -> 정류장 사전 station_key)
+    - 주거지/직장지가 모두 있는 카드만, 판정은 이 테이블에 SEMI JOIN으로 조회
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE home_work AS
+        WITH stops AS (
+            SELECT DISTINCT d.card_key
+                , s.station_key AS stop_key
+                , m.location_type AS role
+            FROM read_parquet('{mapping_path()}') m
+            JOIN {card_dict_sql()} d
+                ON m.card_id = d.가상카드번호
+            JOIN {station_dict_sql()} s
+                ON m.stop_id = s.정류장ID
+                AND m.region_code = s.지역코드
+                AND m.transport_type = s.교통수단구분
+            WHERE m.confidence >= {CONFIG['MIN_CONFIDENCE']}
+                AND m.location_type IN ('residence', 'office')
+            )
+        SELECT *
+        FROM stops
+        QUALIFY COUNT(DISTINCT role) OVER (PARTITION BY card_key) = 2
+    """)
+    cards = con.execute('SELECT COUNT(DISTINCT card_key) FROM home_work').fetchone()[0]
+    print(f"home/work lookup: {cards:,} cards")
+
+def _commute_sql(trip_type, window, board_role, alight_role):
+    "승/하차 정류장이 카드의 (board_role, alight_role) 정류장인 윈도우 내 통행 (home_work에 SEMI JOIN)"
+    return f"""
+            SELECT t.*, '{trip_type}' AS trip_type
+            FROM trips t
+            SEMI JOIN home_work b
+                ON b.card_key = t.card_key AND b.stop_key = t.승차key AND b.role = '{board_role}'
+            SEMI JOIN home_work a
+                ON a.card_key = t.card_key AND a.stop_key = t.하차key AND a.role = '{alight_role}'
+            WHERE {trip_window_sql(window, 't')}"""
+
+def build_commute_trips(con, month, force=False):
+    """
+    월별 출퇴근 통행 parquet 생성 (매핑/설정이 그대로면 기존 파일 재사용)
+    반환: parquet 경로
+    """
+    output_path = commute_trips_path(month)
+    fingerprint = _source_fingerprint(month)
+    if not force and _is_current(output_path, fingerprint):
+        return output_path
+
+    os.makedirs(Path(output_path).parent, exist_ok=True)
+    tables = set(con.execute("SELECT table_name FROM duckdb_tables() WHERE temporary").df()['table_name'])
+    if 'home_work' not in tables:
+        build_home_work_lookup(con)
+
+    morning, evening = CONFIG['MORNING_WINDOW'], CONFIG['EVENING_WINDOW']
+    (m_start, m_end), (e_start, e_end) = morning, evening
+    if not (m_end < e_start or e_end < m_start):
+        raise ValueError(f"오전/오후 윈도우가 겹칩니다: {morning}, {evening}")
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE commute AS
+        -- 1) 통행별 승/하차 정류장 키 (정류장 사전에 없는 정류장은 직주 정류장일 수 없음, 시는 step1 파생 컬럼)
+        WITH trips AS (
+            SELECT p.*
+                , sb.station_key AS 승차key
+                , sa.station_key AS 하차key
+            FROM read_parquet('{purpose_path(month)}') p
+            JOIN {station_dict_sql()} sb
+                ON p.승차정류장ID = sb.정류장ID
+                AND p.승차지역코드 = sb.지역코드
+                AND p.승차교통수단구분 = sb.교통수단구분
+            JOIN {station_dict_sql()} sa
+                ON p.하차정류장ID = sa.정류장ID
+                AND p.하차지역코드 = sa.지역코드
+                AND p.하차교통수단구분 = sa.교통수단구분
+            ),
+        -- 2) 출근/퇴근 판정 (윈도우가 겹치지 않아 한 통행은 둘 중 하나에만 해당)
+        classified AS ({_commute_sql('morning', morning, 'residence', 'office')}
+            UNION ALL{_commute_sql('evening', evening, 'office', 'residence')}
+            )
+        SELECT * EXCLUDE (승차key, 하차key)
+        FROM classified
+    """)
+
+    # 3) 건수는 메타데이터로, 통행은 카드번호 순으로 저장
+    od_cnt, card_cnt = con.execute("""
+        SELECT COUNT(*), COUNT(DISTINCT card_key) FROM commute
+    """).fetchone()
+    source = fingerprint.replace("'", "''")
+    con.execute(f"""
+        COPY (
+            SELECT * FROM commute ORDER BY card_key
+            ) TO '{output_path}.tmp'
+        (FORMAT PARQUET, COMPRESSION ZSTD,
+         KV_METADATA {{monthly_od_cnt: '{od_cnt}', monthly_od_card_cnt: '{card_cnt}', source: '{source}'}})
+    """)
+    os.replace(output_path + '.tmp', output_path)
+    con.execute("DROP TABLE commute")
+    print(f"    [SUC] {month} commute trips extracted: {od_cnt:,} trips, {card_cnt:,} cards")
+    return output_path
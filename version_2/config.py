@@ -1,20 +1,44 @@
-
 CONFIG = {
     #경로
     'DATA_DIR': 'output/purpose_transport',
     'DB_PATH': 'work_od.db',
     'CHECKPOINT_DIR': 'output/work_od_batch',
+    'BATCH_DATA_DIR': 'output/purpose_transport_by_batch',
+    'STATION_DICT_PATH': 'output/station_dict.parquet',     # (정류장ID, 지역코드, 교통수단구분) -> INT32 키
+    'CARD_DICT_PATH': 'output/card_dict.parquet',           # 가상카드번호 -> BIGINT 키 (step1 월별 통합 시 부여)
+    'CALENDAR_PATH': 'output/calendar_dim.parquet',         # 한국 영업일 달력 (calendar_dim.py)
+    'CARD_INDEX_DIR': 'output/card_index',                  # 월별 카드 활동 벡터 (card_index.py)
     'OUTPUT_DIR': 'output',
 
+    # 유효 카드: 주거지/직장지 윈도우 통행이 모두 이 횟수 이상
+    'MIN_WINDOW_TRIPS': 10,
+
     # 배치 설정
     'NUM_BATCHES': 10,
-    
+    'CHUNK_CARDS': 50000,       # 배치 내 청크(재시작 단위) 카드 수
+    'ROW_GROUP_SIZE': 100000,   # 체크포인트 parquet row group 크기
+
     # DBSCAN
     'DBSCAN_EPS': 800,
     'DBSCAN_MIN_SAMPLES': 10,
     'MIN_CONFIDENCE': 0.5,
 
+    # 달력 기본 생성 연도 범위 (양끝 포함, 필요한 연도가 밖이면 자동 확장)
+    'CALENDAR_YEARS': (2023, 2027),
+
+    # 출퇴근 시간 윈도우 (시, 양끝 포함)
+    'MORNING_WINDOW': (6, 10),
+    'EVENING_WINDOW': (16, 24),
+
     # 병렬 설정
     'NUM_WORKERS': 4,
+    'BATCH_RETRIES': 2,         # 실패 배치 재시도 횟수
+    'MEMORY_FRACTION': 0.8,     # 워커 수 산정 시 사용할 가용 메모리 비율
+    'BYTES_PER_ROW': 300,       # 배치 입력 1행당 예상 메모리 (bytes)
+
+    # 적재(step1) 병렬 설정: 워커 수, 워커당 DuckDB 메모리/스레드
+    'INGEST_WORKERS': 4,
+    'INGEST_MEMORY_LIMIT': '12GB',
+    'INGEST_THREADS': 4,
 
-}
\ No newline at end of file
+}
@@ -0,0 +1,59 @@
+"""
+5179 좌표 그리드 인코딩
+문자열 대신 정수 그리드 코드(int64)로 계산하고, 문자열은 내보낼 때만 변환
+
+[그리드 ID] 예전 문자열 인코더(np.char 기반)와 같은 문자열
+- 접두사 2글자: x, y 100km 격자 (x: A~G, y: B~H, 범위 밖은 양끝으로)
+- 접미사 10자리: x, y 정수 좌표의 하위 5자리씩 (0 채움)
+
+[그리드 코드]
+code = 접두사 번호(0~48) * 10^10 + x 하위 5자리 * 10^5 + y 하위 5자리
+- 접두사 번호 = x 격자 * 7 + y 격자
+- 하위 10자리를 10자리로 0 채우면 그대로 접미사
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+GRID_SIZE = 100000
+SUFFIX_MOD = 10 ** 10
+MAX_IDX = 6
+
+# 접두사 번호 -> 2글자 (x: A~G, y: B~H)
+PREFIXES = pa.array([chr(65 + p // 7) + chr(66 + p % 7) for p in range(49)])
+
+def grid_code(x, y):
+    "5179 좌표 -> int64 그리드 코드 (정수 연산만 사용)"
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    xi = np.clip(np.floor(x / GRID_SIZE - 7).astype('int64'), 0, MAX_IDX)
+    yi = np.clip(np.floor(y / GRID_SIZE - 14).astype('int64'), 0, MAX_IDX)
+    xs = np.floor(np.abs(x)).astype('int64') % GRID_SIZE
+    ys = np.floor(np.abs(y)).astype('int64') % GRID_SIZE
+    return (xi * 7 + yi) * SUFFIX_MOD + xs * GRID_SIZE + ys
+
+def format_grid(codes):
+    "int64 그리드 코드 -> 그리드 ID 문자열 (Arrow 일괄 변환, null 유지)"
+    codes = pa.array(codes, type=pa.int64())
+    prefix = PREFIXES.take(pc.divide(codes, SUFFIX_MOD))
+    suffix = pc.utf8_lpad(pc.cast(pc.subtract(codes, pc.multiply(pc.divide(codes, SUFFIX_MOD), SUFFIX_MOD)),
+                                  pa.string()), 10, '0')
+    return pc.binary_join_element_wise(prefix, suffix, '')
+
+# DuckDB 매크로: SQL 안에서 그리드 코드 계산/문자열 변환
+GRID_MACRO_SQL = f"""
+    CREATE OR REPLACE MACRO grid_code(x, y) AS
+        (least(greatest(floor(x / {GRID_SIZE} - 7)::BIGINT, 0), {MAX_IDX}) * 7
+            + least(greatest(floor(y / {GRID_SIZE} - 14)::BIGINT, 0), {MAX_IDX})) * {SUFFIX_MOD}
+        + (floor(abs(x))::BIGINT % {GRID_SIZE}) * {GRID_SIZE}
+        + floor(abs(y))::BIGINT % {GRID_SIZE};
+    CREATE OR REPLACE MACRO grid_id(code) AS
+        chr((65 + (code // {SUFFIX_MOD}) // 7)::INTEGER)
+        || chr((66 + (code // {SUFFIX_MOD}) % 7)::INTEGER)
+        || lpad((code % {SUFFIX_MOD})::VARCHAR, 10, '0');
+"""
+
+def register_grid_macros(con):
+    "연결에 grid_code(x, y), grid_id(code) 매크로 등록"
+    con.execute(GRID_MACRO_SQL)
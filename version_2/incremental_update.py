@@ -0,0 +1,283 @@
+"""
+주거지/직장지 매핑 증분 갱신 (step4~6 전체 재실행 대신)
+새로 들어온 월만 읽어서 DuckDB(CONFIG['DB_PATH'])의 카드별 누적 통계를 갱신하고,
+그 월에 등장한 카드만 다시 클러스터링하여 card_id_work_od_mapping.parquet에 델타 병합
+
+[DB 테이블]
+card_stop_stats: 윈도우(window_type)-카드(card_key)-정류장(좌표) 단위 누적 방문 횟수(cnt)
+    - step5 입력(_load_pattern)과 같은 형태라서 누적 통계만으로 전체 재실행과 같은 결과
+    - 예전 가상카드번호 컬럼 테이블은 카드 사전으로 card_key로 1회 변환
+applied_months: 통계에 반영된 월
+touched: 통계가 바뀌었지만 아직 매핑에 반영되지 않은 카드 (applied_months와 같은 트랜잭션으로 기록,
+    매핑 parquet 재작성 후 비움 -> 중간에 실패하면 다음 실행 시작 시 먼저 처리)
+od_mapping: 매핑 결과 (step6과 같은 테이블)
+
+[pseudo]
+- DATA_DIR에서 보정된 윈도우 테이블이 있는데 아직 반영되지 않은 월 탐색
+  (처음 실행이면 전체 월 -> 전체 재실행과 동일)
+- 월별 카드-정류장 횟수 집계 -> 등장 카드의 누적 통계 교체
+- 등장 카드 중 유효 카드(주거지/직장지 모두 MIN_WINDOW_TRIPS회 이상)만 재클러스터링
+- 등장 카드의 기존 매핑 삭제 후 새 결과 삽입, parquet 재작성
+- 이전 실행에서 남은 touched 카드가 있으면 새 월 탐색 전에 재클러스터링/병합부터 수행
+"""
+
+import argparse, os, time
+from glob import glob
+from pathlib import Path
+import pyarrow as pa
+
+from config import CONFIG
+from utils import db_connection, ensure_dirs, load_station_dict, update_card_dict, card_dict_sql, export_card_ids_sql
+from step5_dbscan import cluster_pattern, RESULT_SCHEMA
+
+STAT_KEYS = ['window_type', 'card_key', 'station_key', 'x_5179', 'y_5179']
+
+def mapping_path():
+    return f"{CONFIG['OUTPUT_DIR']}/card_id_work_od_mapping.parquet"
+
+def init_tables(con):
+    """
+    반영 월/미반영 카드 테이블 생성, od_mapping이 없으면 기존 매핑 parquet에서 적재
+    (card_stop_stats는 첫 반영 시 윈도우 테이블 컬럼 타입 그대로 생성)
+    """
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS applied_months (
+            month VARCHAR
+            , applied_at TIMESTAMP DEFAULT current_timestamp
+            );
+
+        CREATE TABLE IF NOT EXISTS touched (
+            card_key BIGINT
+            );
+    """)
+    tables = set(con.execute("SELECT table_name FROM duckdb_tables()").df()['table_name'])
+    if 'od_mapping' not in tables and Path(mapping_path()).exists():
+        con.execute(f"CREATE TABLE od_mapping AS SELECT * FROM read_parquet('{mapping_path()}')")
+
+    # 예전 통계 테이블(가상카드번호) -> card_key
+    if 'card_stop_stats' in tables:
+        columns = set(con.execute("DESCRIBE card_stop_stats").df()['column_name'])
+        if '가상카드번호' in columns:
+            update_card_dict(con, 'card_stop_stats')
+            con.execute(f"""
+                CREATE OR REPLACE TABLE card_stop_stats AS
+                SELECT s.window_type, d.card_key, s.* EXCLUDE (window_type, 가상카드번호)
+                FROM card_stop_stats s
+                JOIN {card_dict_sql()} d
+                    ON s.가상카드번호 = d.가상카드번호
+            """)
+            print("    [SUC] card_stop_stats converted to card_key")
+
+def pending_months(con):
+    "보정된 주거지/직장지 윈도우 테이블이 모두 있고 아직 반영되지 않은 월"
+    applied = set(con.execute("SELECT month FROM applied_months").df()['month'])
+    months = []
+    for path in sorted(glob(f"{CONFIG['DATA_DIR']}/*/*_residence_windowed_transport_corrected.parquet")):
+        month = Path(path).parent.name
+        office = f"{CONFIG['DATA_DIR']}/{month}/{month}_office_windowed_transport_corrected.parquet"
+        if month not in applied and Path(office).exists():
+            months.append(month)
+    return months
+
+def apply_months(con, months):
+    """
+    월별 카드-정류장 횟수를 누적 통계에 반영 (월 목록 + 통계 갱신을 한 트랜잭션으로)
+    반환: 등장 카드 수 (touched 테이블에 누적, 매핑 반영 후 비움)
+    """
+    keys = ', '.join(STAT_KEYS)
+    sources = []
+    for month in months:
+        for window_type in ['residence', 'office']:
+            sources.append(f"""
+                SELECT '{window_type}' AS window_type, card_key, station_key, 정류장명칭, x_5179, y_5179
+                FROM read_parquet('{CONFIG['DATA_DIR']}/{month}/{month}_{window_type}_windowed_transport_corrected.parquet')""")
+
+    # 1. 새 월 집계 (step5 _load_pattern과 같은 키)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE month_stats AS
+        SELECT {keys}
+            , MIN(정류장명칭) AS 정류장명칭
+            , COUNT(*)::BIGINT AS cnt
+        FROM ({' UNION ALL '.join(sources)})
+        GROUP BY {keys}
+    """)
+    con.execute("CREATE TABLE IF NOT EXISTS card_stop_stats AS SELECT * FROM month_stats WHERE FALSE")
+
+    # 2. 등장 카드의 누적 통계 교체 (NULL 좌표도 같은 그룹으로 묶임)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE merged_stats AS
+            SELECT {keys}
+                , MIN(정류장명칭) AS 정류장명칭
+                , SUM(cnt)::BIGINT AS cnt
+            FROM (
+                SELECT {keys}, 정류장명칭, cnt
+                FROM card_stop_stats
+                SEMI JOIN (SELECT DISTINCT card_key FROM month_stats) USING (card_key)
+                UNION ALL
+                SELECT {keys}, 정류장명칭, cnt
+                FROM month_stats
+                )
+            GROUP BY {keys};
+
+            DELETE FROM card_stop_stats
+            WHERE card_key IN (SELECT card_key FROM month_stats);
+
+            INSERT INTO card_stop_stats BY NAME
+            SELECT * FROM merged_stats;
+
+            INSERT INTO touched
+            SELECT DISTINCT card_key FROM month_stats
+            EXCEPT
+            SELECT card_key FROM touched;
+        """)
+        con.executemany("INSERT INTO applied_months (month) VALUES (?)", [[m] for m in months])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    touched = con.execute("SELECT COUNT(DISTINCT card_key) FROM month_stats").fetchone()[0]
+    con.execute("DROP TABLE month_stats")
+    con.execute("DROP TABLE merged_stats")
+    return touched
+
+def recluster_touched(con):
+    """
+    등장 카드 중 유효 카드만 카드번호 순 청크 단위로 재클러스터링 -> od_delta 임시 테이블
+    유효 카드: 누적 주거지/직장지 횟수 모두 MIN_WINDOW_TRIPS회 이상 (step4 valid_cards와 같은 기준)
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE recluster AS
+        SELECT s.card_key
+        FROM card_stop_stats s
+        SEMI JOIN touched t
+            ON s.card_key = t.card_key
+        GROUP BY s.card_key
+        HAVING SUM(cnt) FILTER (WHERE window_type = 'residence') >= {CONFIG['MIN_WINDOW_TRIPS']}
+            AND SUM(cnt) FILTER (WHERE window_type = 'office') >= {CONFIG['MIN_WINDOW_TRIPS']}
+    """)
+    bounds = con.execute(f"""
+        SELECT card_key
+        FROM (
+            SELECT card_key
+                , row_number() OVER (ORDER BY card_key) - 1 AS rn
+            FROM recluster
+            )
+        WHERE rn % {CONFIG['CHUNK_CARDS']} = 0
+        ORDER BY card_key
+    """).df()['card_key'].tolist()
+    print(f"Reclustering {con.execute('SELECT COUNT(*) FROM recluster').fetchone()[0]:,} valid cards "
+          f"in {len(bounds)} chunks")
+
+    station_dict = load_station_dict()
+    tables = []
+    for i, lo in enumerate(bounds):
+        hi = bounds[i + 1] if i + 1 < len(bounds) else None
+        for window_type in ['residence', 'office']:
+            conditions, params = ['window_type = ?', 's.card_key >= ?'], [window_type, lo]
+            if hi is not None:
+                conditions.append('s.card_key < ?')
+                params.append(hi)
+            data = con.execute(f"""
+                SELECT s.card_key
+                    , station_key
+                    , 정류장명칭
+                    , x_5179
+                    , y_5179
+                    , cnt
+                FROM card_stop_stats s
+                SEMI JOIN recluster r
+                    ON s.card_key = r.card_key
+                WHERE {' AND '.join(conditions)}
+                ORDER BY s.card_key, station_key, x_5179, y_5179
+            """, params).df()
+            tables.append(cluster_pattern(data, window_type, station_dict))
+
+    od_delta = pa.concat_tables(tables) if tables else RESULT_SCHEMA.empty_table()
+    con.register('od_delta_arrow', od_delta)
+    # 매핑 parquet은 기존과 같이 card_id(가상카드번호)로 저장
+    con.execute(f"CREATE OR REPLACE TEMP TABLE od_delta AS {export_card_ids_sql('od_delta_arrow')}")
+    con.unregister('od_delta_arrow')
+    return od_delta.num_rows
+
+def merge_mapping(con):
+    "등장 카드의 기존 매핑 삭제 후 새 결과 삽입, parquet 재작성 후 touched 비움"
+    con.execute("CREATE TABLE IF NOT EXISTS od_mapping AS SELECT * FROM od_delta WHERE FALSE")
+    con.execute("BEGIN TRANSACTION")
+    try:
+        removed = con.execute(f"""
+            DELETE FROM od_mapping
+            WHERE card_id IN (
+                SELECT d.가상카드번호
+                FROM touched t
+                JOIN {card_dict_sql()} d
+                    ON t.card_key = d.card_key
+                )
+        """).fetchone()[0]
+        con.execute("INSERT INTO od_mapping BY NAME SELECT * FROM od_delta")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    output_path = mapping_path()
+    con.execute(f"""
+        COPY od_mapping
+        TO '{output_path}.tmp'
+        (FORMAT PARQUET, COMPRESSION ZSTD)
+    """)
+    os.replace(output_path + '.tmp', output_path)
+    con.execute("DELETE FROM touched")
+    return removed
+
+def sync_mapping(con):
+    "touched 카드 재클러스터링 -> 매핑 병합"
+    added = recluster_touched(con)
+    removed = merge_mapping(con)
+    print(f"    [SUC] mapping delta merged: -{removed:,} / +{added:,} rows")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--dry_run', action='store_true', help='반영할 월만 출력')
+    args = ap.parse_args()
+
+    ensure_dirs()
+    con = db_connection()
+    init_tables(con)
+
+    t0 = time.time()
+    # 이전 실행에서 통계만 반영되고 매핑에 반영되지 않은 카드부터 처리
+    leftover = con.execute("SELECT COUNT(*) FROM touched").fetchone()[0]
+    if leftover:
+        print(f"Resuming mapping merge for {leftover:,} cards from a previous run")
+        if not args.dry_run:
+            sync_mapping(con)
+
+    months = pending_months(con)
+    if not months:
+        print("    [SKIP] no new months to apply")
+        return
+    print(f"Applying months: {', '.join(months)}")
+    if args.dry_run:
+        return
+
+    touched = apply_months(con, months)
+    print(f"    [SUC] card stop stats updated: {touched:,} cards touched")
+    sync_mapping(con)
+
+    stats = con.execute("""
+        SELECT
+            COUNT(*) as total_rows
+            , COUNT(DISTINCT card_id) as unique_cards
+            , COUNT(CASE WHEN location_type = 'residence' THEN 1 END) as residence_rows
+            , COUNT(CASE WHEN location_type = 'office' THEN 1 END) as work_rows
+        FROM od_mapping
+    """).df()
+    print("\n===Results===")
+    print(stats.to_string(index=False))
+    print(f"\n Saved to {mapping_path()} elapsed time: {time.time()-t0:.1f}s")
+    con.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+TS 원천 CSV 스키마 레지스트리
+- DWTCD: TB_KTS_DWTCD_METROPOLITAN 일별 통행 로그
+- STTN: TB_KTS_STTN 월별 정류장 정보
+
+컬럼 타입을 선언해 두고 타입 추론(auto_detect) 없이 읽음
+- 파일 헤더 순서대로 선언 타입을 붙여서 읽기 때문에 컬럼 순서가 바뀌어도 됨
+- 단계별로 필요한 컬럼만 SELECT, 필터는 스캔 바로 위에서 적용
+- 헤더가 선언과 다르면(필수 컬럼 누락, 미등록 컬럼 추가) 월별 컬럼 변경으로 보고 에러
+"""
+
+SCHEMAS = {
+    'DWTCD': {
+        'columns': {
+            '운행일자': 'BIGINT',
+            '정산사ID': 'VARCHAR',
+            '가상카드번호': 'VARCHAR',
+            '정산지역코드': 'BIGINT',
+            '카드구분코드': 'VARCHAR',
+            '정산사차량ID': 'VARCHAR',
+            '교통수단코드': 'BIGINT',
+            '정산사노선ID': 'VARCHAR',
+            '승차일시': 'BIGINT',
+            '정산사승차정류장ID': 'VARCHAR',
+            '하차일시': 'BIGINT',
+            '정산사하차정류장ID': 'VARCHAR',
+            '트랜잭션ID': 'BIGINT',
+            '이용자유형코드(시스템)': 'BIGINT',
+            '이용자수': 'BIGINT',
+            '이용거리': 'DOUBLE',
+            '탑승시간': 'DOUBLE',
+            '환승건수': 'BIGINT',
+        },
+        # 파이프라인에서 쓰는 컬럼 (없으면 에러)
+        'required': ['운행일자', '가상카드번호', '정산지역코드', '교통수단코드', '승차일시', '정산사승차정류장ID',
+                     '하차일시', '정산사하차정류장ID', '트랜잭션ID', '이용자유형코드(시스템)', '이용거리',
+                     '탑승시간', '환승건수'],
+    },
+    'STTN': {
+        'columns': {
+            '운행일자': 'BIGINT',
+            '정산사코드': 'VARCHAR',
+            '지역코드': 'BIGINT',
+            '교통수단구분': 'VARCHAR',
+            '정류장ID': 'VARCHAR',
+            '정류장명칭': 'VARCHAR',
+            '법정동코드': 'VARCHAR',
+            '정류장ARS번호': 'VARCHAR',
+            '정류장GPSY좌표': 'DOUBLE',
+            '정류장GPSX좌표': 'DOUBLE',
+        },
+        'required': ['지역코드', '교통수단구분', '정류장ID', '정류장명칭', '정류장GPSY좌표', '정류장GPSX좌표'],
+    },
+}
+
+def read_header(path):
+    "CSV 첫 줄(헤더) 컬럼 목록"
+    with open(path, encoding='utf-8-sig') as f:
+        return [c.strip().strip('"') for c in f.readline().rstrip('\r\n').split(',')]
+
+def validate_header(table, path):
+    """
+    파일 헤더를 선언 스키마와 비교
+    반환: 헤더 컬럼 목록 / 필수 컬럼 누락이나 미등록 컬럼이 있으면 ValueError
+    """
+    schema = SCHEMAS[table]
+    header = read_header(path)
+    missing = [c for c in schema['required'] if c not in header]
+    unknown = [c for c in header if c not in schema['columns']]
+    if missing or unknown:
+        raise ValueError(f"{table} column drift in {path}: missing={missing}, unknown={unknown}")
+    return header
+
+def read_csv_sql(table, path, columns, where=None):
+    """
+    선언 타입으로 읽는 read_csv 서브쿼리 (FROM 절에 그대로 사용)
+    columns: 읽을 컬럼, where: 스캔 직후 적용할 필터 SQL
+    """
+    header = validate_header(table, path)
+    types = SCHEMAS[table]['columns']
+    spec = ', '.join(f"'{c}': '{types[c]}'" for c in header)
+    select = ', '.join(f'"{c}"' for c in columns)
+    return f"""(
+        SELECT {select}
+        FROM read_csv('{path}', header = true, auto_detect = false, delim = ',', quote = '"',
+                      parallel = true, columns = {{{spec}}})
+        {f'WHERE {where}' if where else ''}
+        )"""
@@ -0,0 +1,135 @@
+"""
+월별 정류장 카탈로그
+TB_KTS_STTN_{month}15.csv 1개당 1회만 파싱하여 타입 지정/정렬된 parquet으로 저장
+- x, y 뒤바뀜 보정, EPSG:4326 -> EPSG:5179 변환, 그리드 부여를 생성 시점에 1회 수행
+- 원본 CSV 내용 해시(sha256) 기준으로 재사용 (수정시각만 바뀐 경우 재생성 안 함)
+- 모든 단계는 load_stations()로 조회 (윈도우 테이블 step2, 정류장 정제 step9)
+
+[컬럼] 정류장ID, 지역코드, 교통수단구분 순 정렬
+station_key: 정류장 사전(CONFIG['STATION_DICT_PATH']) INT32 키
+정류장ID, 지역코드, 교통수단구분, 정류장명칭
+x, y: 원본 GPS 좌표 (정류장GPSX좌표, 정류장GPSY좌표)
+lon, lat: x, y 뒤바뀜 보정 좌표
+x_5179, y_5179: 보정 좌표의 5179 변환 좌표
+grid_code: 5179 좌표 그리드 코드 (int64, 문자열은 grid.format_grid / grid_id 매크로로 변환)
+"""
+
+import os, json, hashlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from config import CONFIG
+from utils import to_5179, update_station_dict
+from grid import grid_code
+from schemas import read_csv_sql
+
+# 출력 컬럼이 바뀌면 올려서 기존 파일 재생성
+TABLE_VERSION = 4
+
+STATION_COLUMNS = ['정류장ID', '지역코드', '교통수단구분', '정류장명칭', '정류장GPSX좌표', '정류장GPSY좌표']
+
+def station_csv_path(month):
+    return f'import_data/TB_KTS_STTN/{month}/TB_KTS_STTN_{month}15.csv'
+
+def station_catalog_path(month):
+    return f'output/station_catalog/{month}/{month}15_station_catalog.parquet'
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def _is_current(month, meta_path):
+    """
+    기존 카탈로그 재사용 여부: 원본 CSV 내용 해시 + 테이블 버전 비교
+    파일 크기/수정시각이 기록과 같으면 해시 재계산 생략
+    """
+    if not Path(meta_path).exists():
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('version') != TABLE_VERSION:
+        return False
+    stat = os.stat(station_csv_path(month))
+    if (meta.get('size'), meta.get('mtime')) == (stat.st_size, stat.st_mtime):
+        return True
+    if meta.get('sha256') != _file_sha256(station_csv_path(month)):
+        return False
+    # 내용은 같고 수정시각만 바뀐 경우: 기록만 갱신
+    meta.update(size=stat.st_size, mtime=stat.st_mtime)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return True
+
+def build_station_catalog(con, month, force=False):
+    """
+    월별 정류장 카탈로그 생성 (원본 CSV 내용이 그대로면 기존 파일 재사용)
+    반환: parquet 경로
+    """
+    output_path = station_catalog_path(month)
+    meta_path = output_path + '.src.json'
+
+    if (not force and Path(output_path).exists() and Path(CONFIG['STATION_DICT_PATH']).exists()
+            and _is_current(month, meta_path)):
+        return output_path
+
+    os.makedirs(Path(output_path).parent, exist_ok=True)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE station_src AS
+        SELECT TRY_CAST(정류장ID AS BIGINT) AS 정류장ID
+            , 지역코드
+            , 교통수단구분
+            , 정류장명칭
+            , 정류장GPSX좌표 AS x
+            , 정류장GPSY좌표 AS y
+        FROM {read_csv_sql('STTN', station_csv_path(month), STATION_COLUMNS)}
+        """)
+
+    # 정류장 사전에 새 정류장 추가 후 키 부여
+    added = update_station_dict(con, 'station_src')
+    station = con.execute(f"""
+        SELECT d.station_key
+            , s.*
+            -- x, y 좌표 뒤바뀐 경우 보정
+            , CASE WHEN s.x < 100 THEN s.y
+                ELSE s.x END AS lon
+            , CASE WHEN s.y > 100 THEN s.x
+                ELSE s.y END AS lat
+        FROM station_src s
+        LEFT JOIN read_parquet('{CONFIG['STATION_DICT_PATH']}') d
+            ON s.정류장ID = d.정류장ID
+            AND s.지역코드 = d.지역코드
+            AND s.교통수단구분 = d.교통수단구분
+        ORDER BY s.정류장ID, s.지역코드, s.교통수단구분, s.rowid
+        """).df()
+    con.execute("DROP TABLE station_src")
+    station['station_key'] = station['station_key'].astype('Int32')
+
+    # 5179로 변환 (정류장 수만큼 1회)
+    lon, lat = station['lon'].to_numpy(float), station['lat'].to_numpy(float)
+    has_xy = ~(np.isnan(lon) | np.isnan(lat))
+    x_5179, y_5179 = np.full(len(station), np.nan), np.full(len(station), np.nan)
+    x_5179[has_xy], y_5179[has_xy] = to_5179(lon[has_xy], lat[has_xy])
+    station['x_5179'], station['y_5179'] = x_5179, y_5179
+
+    # 그리드 코드 (변환 좌표가 유한한 정류장만)
+    finite = np.isfinite(x_5179) & np.isfinite(y_5179)
+    station['grid_code'] = pd.Series(pd.NA, index=station.index, dtype='Int64')
+    station.loc[finite, 'grid_code'] = grid_code(x_5179[finite], y_5179[finite])
+
+    station.to_parquet(output_path + '.tmp', index=False)
+    os.replace(output_path + '.tmp', output_path)
+    stat = os.stat(station_csv_path(month))
+    with open(meta_path, 'w') as f:
+        json.dump({'source': station_csv_path(month), 'sha256': _file_sha256(station_csv_path(month)),
+                   'size': stat.st_size, 'mtime': stat.st_mtime, 'version': TABLE_VERSION}, f)
+    print(f"    [SUC] {month}15 station catalog built: {len(station)} stations "
+          f"({added} new in station dict)")
+    return output_path
+
+def load_stations(con, month):
+    "월별 정류장 카탈로그 조회용 SQL (없거나 원본이 바뀌었으면 생성) - FROM 절에 사용"
+    return f"read_parquet('{build_station_catalog(con, month)}')"
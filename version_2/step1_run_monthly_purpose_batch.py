@@ -1,115 +1,233 @@
 import numpy as np
-import pandas as pd 
+import pandas as pd
 import time, os, argparse
 import duckdb
 from glob import glob
-from pathlib import Path 
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import CONFIG
+from schemas import read_csv_sql
+import pyarrow.parquet as pq
+from utils import ymd_date_sql, ymdhms_timestamp_sql, ymdhms_hour_sql, update_card_dict, card_dict_sql
+from calendar_dim import calendar_path, ensure_calendar
 
 # 목적통행 디렉토리 생성
 output_base='output/purpose_transport'
 os.makedirs(output_base, exist_ok=True)
 
-## 목적통행 집계 
-## 월별 순회하며 목적통행으로 집계하여 parquet으로 저장하는 프로세스
+## 목적통행 집계
+## 일별 원본 파일을 프로세스 풀로 나눠 목적통행으로 집계하고, 월별로 통합하여 parquet으로 저장하는 프로세스
 
 months = ['202501', '202502', '202503', '202504', '202505', '202506']
 
+# 목적통행 집계에 쓰는 원본 컬럼
+TRIP_COLUMNS = ['운행일자', '가상카드번호', '트랜잭션ID', '정산사승차정류장ID', '정산사하차정류장ID', '승차일시',
+                '하차일시', '정산지역코드', '교통수단코드', '이용거리', '탑승시간', '환승건수']
+
+# step1에서 1회 계산하는 파생 컬럼 (일별 파일에 없으면 재적재)
+DERIVED_COLUMNS = ['운행일', '승차시각', '하차시각', '승차hour', '하차hour', '영업일']
+
 def is_duckdb_interrupt(e:Exception) -> bool:
     name = e.__class__.__name__.lower()
     msg= (str(e) or "").lower()
     return ("interrupt" in name or "interrupted" in msg)
 
-def main(months):
-    # DuckDB setting 
+def collect_days(months):
+    """
+    처리 대상 일별 파일 목록 생성
+    이미 처리된 파일(파생 컬럼 포함)은 제외하고, 월 구분 없이 파일 크기 내림차순(큰 파일 먼저)으로 정렬
+    """
+    tasks = []
+    for month in months:
+        for day in glob(f"import_data/TB_KTS_DWTCD_METROPOLITAN/{month}/*.csv"):
+            output_base_path = f'output/purpose_transport/{month}/{day[-12:-4]}'
+            output_path = os.path.join(output_base_path, 'daily_purpose.parquet')
+
+            # 이미 파일 존재할 경우 패스 (파생 컬럼 없는 예전 형식은 다시 적재)
+            if (Path(output_path).exists() and not Path(output_base_path, '_ERROR').exists()
+                    and set(DERIVED_COLUMNS) <= set(pq.read_schema(output_path).names)):
+                continue
+            tasks.append((os.path.getsize(day), month, day))
+
+    tasks.sort(key=lambda t: t[0], reverse=True)
+    return tasks
+
+def ingest_day(month, day, memory_limit, threads):
+    """
+    일별 원본 CSV 1개 -> daily_purpose.parquet
+    워커 프로세스마다 별도의 DuckDB 연결을 사용하며, 행 수는 COPY 결과값으로 받음
+    반환: (month, day, length, elapsed, error)
+    """
+    t0 = time.time()
+    output_base_path = f'output/purpose_transport/{month}/{day[-12:-4]}'
+    os.makedirs(output_base_path, exist_ok=True)
+    output_path = os.path.join(output_base_path, 'daily_purpose.parquet')
+    tmp_path = output_path + '.tmp'
+
     con = duckdb.connect()
-    con.execute(f"SET memory_limit='50GB'")
+    con.execute(f"SET memory_limit='{memory_limit}'")
+    con.execute(f"SET threads={threads}")
+    try:
+        # 선언 스키마로 필요한 컬럼만 읽기 (헤더 컬럼 변경 시 에러), 이용자유형 필터는 스캔 단계에서
+        trips = read_csv_sql('DWTCD', day, TRIP_COLUMNS, where='"이용자유형코드(시스템)" = 1')
 
-    # 월 순회
-    for month in months:
-        
-        days = glob(f"import_data/TB_KTS_DWTCD_METROPOLITAN/{month}/**.csv")
-        length_df= []
-        # output 폴더 만들기
-        
-        for day in days: 
-            try: 
-                t0 = time.time()
-                print(f"Processing {day[-12:-4]} file for month={month}")
-                output_base_path = f'output/purpose_transport/{month}/{day[-12:-4]}'
-                os.makedirs(output_base_path, exist_ok=True)
-                output_path = os.path.join(output_base_path, 'daily_purpose.parquet')
-                
-                # 이미 파일 존재할 경우 패스
-                if Path(output_path).exists() and ~(Path(output_path/'_ERROR').exists()):
-                    continue
-                
-                # 목적통행 집계 수행 
-                con.execute(f""" 
-                COPY(
-                SELECT 운행일자
-                    , 가상카드번호
-                    , 트랜잭션ID
-                    -- 첫 승차/ 마지막 하차
-                    , TRY_CAST(arg_min(정산사승차정류장ID, 승차일시) AS BIGINT) AS 승차정류장ID
-                    , TRY_CAST(arg_max(정산사하차정류장ID, 하차일시) AS BIGINT) AS 하차정류장ID
-                    , MIN(승차일시) AS 승차일시
-                    , MAX(하차일시) AS 하차일시
-                    , arg_min(정산지역코드, 승차일시) AS 승차지역코드
-                    , arg_max(정산지역코드, 하차일시) AS 하차지역코드
-                    , CASE WHEN arg_min(교통수단코드, 승차일시) BETWEEN 200 AND 299 THEN 'T'
-                        ELSE 'B' END AS 승차교통수단구분
-                    , CASE WHEN arg_max(교통수단코드, 하차일시) BETWEEN 200 AND 299 THEN 'T'
-                        ELSE 'B' END AS 하차교통수단구분
-                    -- 집계
-                    , SUM(이용거리) AS 총이동거리
-                    , SUM(탑승시간) AS 총탑승시간
-                    , MAX(환승건수) AS 최대환승건수
-                FROM read_csv('{day}', 
-                    types={{'정산사노선ID':'VARCHAR', '가상카드번호':'VARCHAR'}})
-                WHERE "이용자유형코드(시스템)" = 1
-                GROUP BY 운행일자, 가상카드번호, 트랜잭션ID
-                HAVING MIN(승차일시) IS NOT NULL AND MAX(하차일시) IS NOT NULL
-                )
-                TO '{output_path}'
-                (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 512000)
-                ;
-                """)
-
-                length = con.execute(f"select count(*) from read_parquet('{output_path}');").fetchone()[0]
-                # 실제 집계 수행
-                print(f"    [SUC] Day {day[-8:4]}:{length} purpose trips, elapsed_time: {round(time.time()-t0, 1)}s")
-
-                # 길이 메타 데이터 df로 저장
-                length_df.append([{'day': day, 'length': length}])
-                
-            except KeyboardInterrupt:
-                print("--stopping cleanly", flush=True)
-                raise
-            except Exception as e:
-                if is_duckdb_interrupt(e):
-                    raise KeyboardInterrupt from e 
-                ## output path에 error 칩 추가
-                Path(output_path/'_ERROR').touch()
-                print(f"    [ERR] processing {day}: {e}")
-    
-        # 월별 결과 저장
-        
-        # 월별집계 결과 없을 경우 패스
-        if Path('output'/'purpose_transport'/f'{month}'/f'{month}_purpose_transport.parqeut').exists():
-            continue
-        # length_df 쌓이지 않은 경우 패스
-        if length_df != []:
-            pd.concat([length_df]).to_csv(f'output/purpose_transport/{month}/{month}_length.csv')
-            
-        con.execute(f"""
+        # 목적통행 집계 수행 + 파생 컬럼(운행일, 승하차 시각/시, 영업일) 1회 계산
+        length = con.execute(f"""
         COPY(
-            SELECT * FROM read_parquet('output/purpose_transport/{month}/*/*.parquet')
-            )
-        TO 'output/purpose_transport/{month}/{month}_purpose_transport.parquet'
-        (FORMAT PARQUET, COMPRESSION zstd)
-        """)
-        
-        print(f"[SUC] Processed and saved data for {month}")
-        
+        WITH purpose AS (
+        SELECT 운행일자
+            , 가상카드번호
+            , 트랜잭션ID
+            -- 첫 승차/ 마지막 하차
+            , TRY_CAST(arg_min(정산사승차정류장ID, 승차일시) AS BIGINT) AS 승차정류장ID
+            , TRY_CAST(arg_max(정산사하차정류장ID, 하차일시) AS BIGINT) AS 하차정류장ID
+            , MIN(승차일시) AS 승차일시
+            , MAX(하차일시) AS 하차일시
+            , arg_min(정산지역코드, 승차일시) AS 승차지역코드
+            , arg_max(정산지역코드, 하차일시) AS 하차지역코드
+            , CASE WHEN arg_min(교통수단코드, 승차일시) BETWEEN 200 AND 299 THEN 'T'
+                ELSE 'B' END AS 승차교통수단구분
+            , CASE WHEN arg_max(교통수단코드, 하차일시) BETWEEN 200 AND 299 THEN 'T'
+                ELSE 'B' END AS 하차교통수단구분
+            -- 집계
+            , SUM(이용거리) AS 총이동거리
+            , SUM(탑승시간) AS 총탑승시간
+            , MAX(환승건수) AS 최대환승건수
+        FROM {trips}
+        GROUP BY 운행일자, 가상카드번호, 트랜잭션ID
+        HAVING MIN(승차일시) IS NOT NULL AND MAX(하차일시) IS NOT NULL
+        )
+        SELECT p.*
+            , {ymd_date_sql('p.운행일자')} AS 운행일
+            , {ymdhms_timestamp_sql('p.승차일시')} AS 승차시각
+            , {ymdhms_timestamp_sql('p.하차일시')} AS 하차시각
+            , {ymdhms_hour_sql('p.승차일시')} AS 승차hour
+            , {ymdhms_hour_sql('p.하차일시')} AS 하차hour
+            , c.is_business_day AS 영업일
+        FROM purpose p
+        -- 영업일은 달력 조회 (운행일자 정수 그대로 조인)
+        LEFT JOIN read_parquet('{calendar_path()}') c
+            ON p.운행일자 = c.ymd
+        )
+        TO '{tmp_path}'
+        (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 512000)
+        ;
+        """).fetchone()[0]
+
+        # 완료된 파일만 최종 경로로 이동 (중단 시 미완성 파일이 남지 않도록)
+        os.replace(tmp_path, output_path)
+        Path(output_base_path, '_ERROR').unlink(missing_ok=True)
+        return month, day, length, time.time()-t0, None
+
+    except KeyboardInterrupt:
+        raise
+    except Exception as e:
+        if is_duckdb_interrupt(e):
+            raise KeyboardInterrupt from e
+        ## output path에 error 칩 추가
+        Path(output_base_path, '_ERROR').touch()
+        return month, day, None, time.time()-t0, str(e)
+    finally:
+        con.close()
+
+def _monthly_is_current(monthly_path, daily_paths):
+    "월별 파일이 card_key 형식이고 모든 일별 파일보다 나중에 만들어졌는지"
+    if not Path(monthly_path).exists() or 'card_key' not in pq.read_schema(monthly_path).names:
+        return False
+    return os.path.getmtime(monthly_path) >= max(os.path.getmtime(p) for p in daily_paths)
+
+def merge_month(con, month, length_df):
+    """
+    일별 결과를 월별 목적통행 파일로 통합
+    가상카드번호는 카드 사전(CONFIG['CARD_DICT_PATH'])에 등록하고 BIGINT card_key로 바꿔서 저장
+    """
+    # length_df 쌓이지 않은 경우 패스 (기존 기록에 이번 실행 일자만 교체/추가)
+    if length_df != []:
+        length_path = f'output/purpose_transport/{month}/{month}_length.csv'
+        lengths = pd.DataFrame(length_df)
+        if Path(length_path).exists():
+            previous = pd.read_csv(length_path)
+            lengths = pd.concat([previous[~previous['day'].isin(lengths['day'])], lengths])
+        lengths.sort_values('day').to_csv(length_path, index=False)
+
+    # 일별 결과가 없거나, 이번 실행에서 적재한 일자가 없고 월별집계 결과가 최신이면 패스
+    monthly_path = f'output/purpose_transport/{month}/{month}_purpose_transport.parquet'
+    daily_paths = glob(f'output/purpose_transport/{month}/*/daily_purpose.parquet')
+    if not daily_paths:
+        print(f"    [SKIP] no daily files for {month}")
+        return
+    if not length_df and _monthly_is_current(monthly_path, daily_paths):
+        return
+
+    daily = f"read_parquet('output/purpose_transport/{month}/*/daily_purpose.parquet')"
+    added = update_card_dict(con, daily)
+    print(f"    {month}: {added:,} new cards added to card dictionary")
+    con.execute(f"""
+    COPY(
+        SELECT p.운행일자
+            , c.card_key
+            , p.* EXCLUDE (운행일자, 가상카드번호)
+        FROM {daily} p
+        JOIN {card_dict_sql()} c
+            ON p.가상카드번호 = c.가상카드번호
+        )
+    TO '{monthly_path}.tmp'
+    (FORMAT PARQUET, COMPRESSION zstd)
+    """)
+    os.replace(monthly_path + '.tmp', monthly_path)
+
+    print(f"[SUC] Processed and saved data for {month}")
+
+def main(months, workers=CONFIG['INGEST_WORKERS'],
+         memory_limit=CONFIG['INGEST_MEMORY_LIMIT'], threads=CONFIG['INGEST_THREADS']):
+    # 영업일 달력은 워커 시작 전에 1회 준비
+    ensure_calendar([m[:4] for m in months])
+    tasks = collect_days(months)
+    print(f"{len(tasks)} day files to ingest (workers={workers}, memory_limit={memory_limit}, threads={threads})")
+
+    length_df = {month: [] for month in months}
+    t_all = time.time()
+
+    # 1. 일별 집계: 워커 수 1이면 현재 프로세스에서 순차 처리
+    if workers <= 1:
+        results = (ingest_day(month, day, memory_limit, threads) for _, month, day in tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = [executor.submit(ingest_day, month, day, memory_limit, threads) for _, month, day in tasks]
+        results = (f.result() for f in as_completed(futures))
+
+    try:
+        for month, day, length, elapsed, error in results:
+            if error is not None:
+                print(f"    [ERR] processing {day}: {error}")
+                continue
+            # 길이 메타 데이터 저장
+            length_df[month].append({'day': day, 'length': length})
+            print(f"    [SUC] Day {day[-12:-4]}:{length} purpose trips, elapsed_time: {round(elapsed, 1)}s")
+    except KeyboardInterrupt:
+        print("--stopping cleanly", flush=True)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    if executor is not None:
+        executor.shutdown()
+
+    print(f"[SUC] {len(tasks)} day files ingested, elapsed_time: {round(time.time()-t_all, 1)}s")
+
+    # 2. 월별 결과 저장
+    con = duckdb.connect()
+    con.execute(f"SET memory_limit='50GB'")
+    for month in months:
+        merge_month(con, month, length_df[month])
+    con.close()
+
 if __name__ == '__main__':
-    main(months)
\ No newline at end of file
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=CONFIG['INGEST_WORKERS'], help="일별 파일 동시 처리 프로세스 수")
+    ap.add_argument("--memory_limit", default=CONFIG['INGEST_MEMORY_LIMIT'], help="워커당 DuckDB memory_limit")
+    ap.add_argument("--threads", type=int, default=CONFIG['INGEST_THREADS'], help="워커당 DuckDB threads")
+    args = ap.parse_args()
+
+    main(months, args.workers, args.memory_limit, args.threads)
@@ -1,19 +1,20 @@
 import duckdb as duck
-import pandas as pd 
+import pandas as pd
 import numpy as np
-import time, os, holidays
+import time, os, shutil
 import warnings
 import duckdb
+from glob import glob
 from pathlib import Path
 
+from config import CONFIG
+from stations import load_stations
+from utils import hour_window_sql, parquet_has_columns, WINDOWED_COLUMNS
+
 # Duckdb
 con = duckdb.connect()
 con.execute("SET memory_limit='50GB'")
 
-# 공휴일 등록 - 한국 기준 
-kr_holidays= holidays.SouthKorea(years=2025)
-holiday_df = pd.DataFrame([{'holiday_date': date} for date in kr_holidays.keys() if date.month <=6])
-con.register("holidays", holiday_df)
 months = ['202501', '202502', '202503', '202504', '202505', '202506']
 
 # DuckDB용 KeyboardInterrrupt 설정
@@ -22,136 +23,130 @@ def is_duckdb_interrupt(e:Exception) -> bool:
     msg= (str(e) or "").lower()
     return ("interrupt" in name or "interrupted" in msg)
 
-for month in months:
-    try:
-        print(f"Processing: {month}")
-        output_path = f'output/purpose_transport/{month}'
-        
-        # 주거지 파일 존재 시: 패스
-        if not Path(f"{output_path}/{month}_residence_windowed_transport.parquet").exists():
-            print(f"Processing: residence windowed transport")
-            ## 1. 주거지 타임 윈도우 테이블 생성 
-            con.execute(f'''
-                COPY (
-                -- 1) 승차
-                WITH board AS(
-                    select t.운행일자
-                        , t.가상카드번호
-                        , t.승차정류장ID AS 정류장ID
-                        , substr(t.승차일시::VARCHAR, 9, 2) AS hour
-                        , 'board' AS type
-                        , t.승차지역코드 AS 지역코드
-                        , t.승차교통수단구분 AS 교통수단구분
-                        , st1.정류장명칭
-                        , st1.정류장GPSY좌표 AS y
-                        , st1.정류장GPSX좌표 AS x
-                    from read_parquet('output/purpose_transport/{month}/{month}_purpose_transport.parquet') t
-                    LEFT JOIN holidays h
-                        ON STRPTIME(t.운행일자::TEXT, '%Y%m%d')::DATE = h.holiday_date
-                    LEFT JOIN read_csv('import_data/TB_KTS_STTN/{month}/TB_KTS_STTN_{month}15.csv') st1
-                        ON t.승차정류장ID = st1.정류장ID
-                        AND t.승차지역코드 = st1.지역코드
-                        AND t.승차교통수단구분 = st1.교통수단구분  
-                    WHERE DAYOFWEEK(STRPTIME(t.운행일자::TEXT, '%Y%m%d')::DATE) NOT IN (0,6) -- 일:0 토:6
-                        AND h.holiday_date IS NULL
-                        AND substr(승차일시::VARCHAR, 9, 2)::INT BETWEEN 6 AND 10
-                        ),
-                -- 2) 하차
-                alight AS (
-                    select t.운행일자
-                        , t.가상카드번호
-                        , t.하차정류장ID AS 정류장ID
-                        , substr(t.하차일시::VARCHAR, 9, 2) AS hour
-                        , 'alight' AS type
-                        , t.하차지역코드 AS 지역코드
-                        , t.하차교통수단구분 AS 교통수단구분
-                        , st2.정류장명칭
-                        , st2.정류장GPSY좌표 AS y
-                        , st2.정류장GPSX좌표 AS x
-                    from read_parquet('output/purpose_transport/{month}/{month}_purpose_transport.parquet') t
-                    LEFT JOIN holidays h
-                        ON STRPTIME(t.운행일자::TEXT, '%Y%m%d')::DATE = h.holiday_date
-                    LEFT JOIN read_csv('import_data/TB_KTS_STTN/{month}/TB_KTS_STTN_{month}15.csv') st2
-                        ON t.하차정류장ID = st2.정류장ID
-                        AND t.하차지역코드 = st2.지역코드
-                        AND t.하차교통수단구분 = st2.교통수단구분   
-                    WHERE DAYOFWEEK(STRPTIME(t.운행일자::TEXT, '%Y%m%d')::DATE) NOT IN (0,6) -- 일:0 토:6
-                        AND h.holiday_date IS NULL
-                        AND substr(하차일시::VARCHAR, 9, 2)::INT BETWEEN 16 AND 24
-                    )
-                SELECT *
-                FROM board
-                UNION ALL
-                SELECT *
-                FROM alight
-                )
-                TO '{output_path}/{month}_residence_windowed_transport.parquet'
-                (FORMAT PARQUET, COMPRESSION ZSTD);
-                ''')
-            print(f"    [SUC] {month} residence windowed table successfully created into parquet") 
-        
-        ## 2. 직장지 타임 윈도우 테이블 생성 
-        ## 직장지 작업파일 있을 경우 생략됨
-        if Path(f"{output_path}/{month}_office_windowed_transport.parquet").exists():
-            continue
-        print(f"   Processing: office windowed transport")
-        con.execute(f'''
-            COPY (
-            WITH board AS(
-                select t.운행일자
-                    , t.가상카드번호
-                    , t.승차정류장ID AS 정류장ID
-                    , substr(t.승차일시::VARCHAR, 9, 2) AS hour
-                    , 'board' AS type
-                    , t.승차지역코드 AS 지역코드
-                    , t.승차교통수단구분 AS 교통수단구분
-                    , st1.정류장명칭
-                    , st1.정류장GPSY좌표 AS y
-                    , st1.정류장GPSX좌표 AS x
-                from read_parquet('output/purpose_transport/{month}/{month}_purpose_transport.parquet') t
-                LEFT JOIN holidays h
-                    ON STRPTIME(t.운행일자::TEXT, '%Y%m%d')::DATE = h.holiday_date
-                LEFT JOIN read_csv('import_data/TB_KTS_STTN/{month}/TB_KTS_STTN_{month}15.csv') st1
-                    ON t.승차정류장ID = st1.정류장ID
-                    AND t.승차지역코드 = st1.지역코드
-                    AND t.승차교통수단구분 = st1.교통수단구분  
-                WHERE DAYOFWEEK(STRPTIME(t.운행일자::TEXT, '%Y%m%d')::DATE) NOT IN (0,6) -- 일:0 토:6
-                    AND h.holiday_date IS NULL
-                    AND substr(승차일시::VARCHAR, 9, 2)::INT BETWEEN 16 AND 24
-                    ),
-            alight AS (
-                select t.운행일자
-                    , t.가상카드번호
-                    , t.하차정류장ID AS 정류장ID
-                    , substr(t.하차일시::VARCHAR, 9, 2) AS hour
-                    , 'alight' AS type
-                    , t.하차지역코드 AS 지역코드
-                    , t.하차교통수단구분 AS 교통수단구분
-                    , st2.정류장명칭
-                    , st2.정류장GPSY좌표 AS y
-                    , st2.정류장GPSX좌표 AS x
-                from read_parquet('output/purpose_transport/{month}/{month}_purpose_transport.parquet') t
-                LEFT JOIN holidays h
-                    ON STRPTIME(t.운행일자::TEXT, '%Y%m%d')::DATE = h.holiday_date
-                LEFT JOIN read_csv('import_data/TB_KTS_STTN/{month}/TB_KTS_STTN_{month}15.csv') st2
-                    ON t.하차정류장ID = st2.정류장ID
-                    AND t.하차지역코드 = st2.지역코드
-                    AND t.하차교통수단구분 = st2.교통수단구분   
-                WHERE DAYOFWEEK(STRPTIME(t.운행일자::TEXT, '%Y%m%d')::DATE) NOT IN (0,6) -- 일:0 토:6
-                    AND h.holiday_date IS NULL
-                    AND substr(하차일시::VARCHAR, 9, 2)::INT BETWEEN 6 AND 10
-                )
-            SELECT *
-            FROM board
-            UNION ALL
+def split_time_windows(con, month, morning=CONFIG['MORNING_WINDOW'], evening=CONFIG['EVENING_WINDOW']):
+    """
+    월별 목적통행 테이블 1회 스캔으로 주거지/직장지 타임 윈도우 테이블 동시 생성
+    - 주거지(residence): 오전 윈도우 승차 + 오후 윈도우 하차
+    - 직장지(office): 오후 윈도우 승차 + 오전 윈도우 하차
+    - 정류장은 (정류장ID, 지역코드, 교통수단구분) 대신 정류장 사전 INT32 키(station_key)로 저장
+    """
+    (m_start, m_end), (e_start, e_end) = morning, evening
+    if not (m_end < e_start or e_end < m_start):
+        raise ValueError(f"오전/오후 윈도우가 겹칩니다: {morning}, {evening}")
+
+    output_path = f'output/purpose_transport/{month}'
+    purpose_path = f'{output_path}/{month}_purpose_transport.parquet'
+
+    # 작업파일 있는 윈도우는 생략 (card_key/station_key/5179 좌표 없는 예전 형식은 다시 생성)
+    targets = [w for w in ('residence', 'office')
+               if not parquet_has_columns(f"{output_path}/{month}_{w}_windowed_transport.parquet", WINDOWED_COLUMNS)]
+    if not targets:
+        return []
+    print(f"   Processing: {', '.join(targets)} windowed transport")
+
+    # 1) 정류장 카탈로그(월 1회 생성) -> 조회 테이블
+    con.execute(f'''
+        CREATE OR REPLACE TEMP TABLE station AS
+        SELECT station_key
+            , 정류장ID
+            , 지역코드
+            , 교통수단구분
+            , 정류장명칭
+            , y
+            , x
+            , x_5179
+            , y_5179
+        FROM {load_stations(con, month)}
+        ''')
+
+    # 2) 승차/하차 이벤트로 펼쳐서 윈도우 구분 (임시 테이블 없이 COPY로 바로 스트리밍)
+    target_list = "', '".join(targets)
+    windowed_sql = f'''
+        -- 2.1) 월별 목적통행 1회 스캔 (영업일/시는 step1 파생 컬럼)
+        WITH trips AS (
+            SELECT t.운행일자
+                , t.card_key
+                , t.승차정류장ID
+                , t.승차지역코드
+                , t.승차교통수단구분
+                , t.승차hour
+                , t.하차정류장ID
+                , t.하차지역코드
+                , t.하차교통수단구분
+                , t.하차hour
+            FROM read_parquet('{purpose_path}') t
+            WHERE t.영업일
+            ),
+        -- 2.2) 통행 1건 -> 승차/하차 이벤트 2건
+        events AS (
+            SELECT t.운행일자
+                , t.card_key
+                , CASE WHEN e.type = 'board' THEN t.승차정류장ID ELSE t.하차정류장ID END AS 정류장ID
+                , CASE WHEN e.type = 'board' THEN t.승차hour ELSE t.하차hour END AS hour
+                , e.type
+                , CASE WHEN e.type = 'board' THEN t.승차지역코드 ELSE t.하차지역코드 END AS 지역코드
+                , CASE WHEN e.type = 'board' THEN t.승차교통수단구분 ELSE t.하차교통수단구분 END AS 교통수단구분
+            FROM trips t
+            CROSS JOIN (VALUES ('board'), ('alight')) e(type)
+            ),
+        -- 2.3) 윈도우 구분
+        labeled AS (
             SELECT *
-            FROM alight
+                , CASE WHEN (type = 'board' AND {hour_window_sql('hour', morning)})
+                            OR (type = 'alight' AND {hour_window_sql('hour', evening)}) THEN 'residence'
+                       WHEN (type = 'board' AND {hour_window_sql('hour', evening)})
+                            OR (type = 'alight' AND {hour_window_sql('hour', morning)}) THEN 'office'
+                    END AS window_type
+            FROM events
             )
-            TO '{output_path}/{month}_office_windowed_transport.parquet'
-            (FORMAT PARQUET, COMPRESSION ZSTD);
-            ''')
-        print(f"    [SUC] {month} office windowed table successfully created into parquet") 
-    except Exception as e:
-        if is_duckdb_interrupt(e):
-            raise KeyboardInterrupt from e 
-        print(f"    [FAIL] {month} failed: {e}")
\ No newline at end of file
+        SELECT l.운행일자
+            , l.card_key
+            , st.station_key
+            , l.hour
+            , l.type
+            , st.정류장명칭
+            , st.y
+            , st.x
+            , st.x_5179
+            , st.y_5179
+            , l.window_type
+        FROM labeled l
+        LEFT JOIN station st
+            ON l.정류장ID = st.정류장ID
+            AND l.지역코드 = st.지역코드
+            AND l.교통수단구분 = st.교통수단구분
+        WHERE l.window_type IN ('{target_list}')
+        '''
+
+    # 3) 1회 스캔 -> window_type별 파티션 parquet -> 윈도우별 최종 경로로 이동
+    staging_dir = f"{output_path}/_windowed_staging"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    con.execute(f'''
+        COPY ({windowed_sql})
+        TO '{staging_dir}'
+        (FORMAT PARQUET, PARTITION_BY (window_type), COMPRESSION ZSTD);
+        ''')
+    for window_type in targets:
+        target_path = f"{output_path}/{month}_{window_type}_windowed_transport.parquet"
+        parts = sorted(glob(f"{staging_dir}/window_type={window_type}/*.parquet"))
+        if len(parts) == 1:
+            os.replace(parts[0], target_path)
+        else:
+            # 파티션 파일이 여러 개(또는 해당 윈도우 이벤트 없음)면 스키마 유지하며 1개 파일로
+            source = f"read_parquet({parts}, hive_partitioning = false)" if parts else f"(SELECT * EXCLUDE (window_type) FROM ({windowed_sql}) WHERE FALSE)"
+            con.execute(f"COPY (SELECT * FROM {source}) TO '{target_path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+        print(f"    [SUC] {month} {window_type} windowed table successfully created into parquet")
+    shutil.rmtree(staging_dir)
+
+    con.execute("DROP TABLE station")
+    return targets
+
+if __name__ == '__main__':
+    for month in months:
+        try:
+            print(f"Processing: {month}")
+            split_time_windows(con, month)
+        except Exception as e:
+            if is_duckdb_interrupt(e):
+                raise KeyboardInterrupt from e
+            print(f"    [FAIL] {month} failed: {e}")
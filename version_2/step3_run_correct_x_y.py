@@ -6,6 +6,8 @@ import pandas as pd
 import numpy as np
 from pyproj import Transformer
 
+from utils import parquet_has_columns, WINDOWED_COLUMNS
+
 ## 좌표값 정확성 검증 -> 널값, 99999값등 제거 
 ## 좌표값 중에 x,y를 비교해서 아닌 게 있으면 바꿔줘서 다시 저장함
 # 몇 개 바꿨는지 확인
@@ -38,8 +40,9 @@ for month in months:
     # 타입 순회
     for work_type in work_types:
         try:
-            # corrected 파일 존재할 시 생략
-            if Path(output_base/f'{month}'/f'{month}_{work_type}_windowed_transport_corrected.parquet').exists():
+            # corrected 파일 존재할 시 생략 (card_key/station_key/5179 좌표 없는 예전 형식은 다시 생성)
+            if parquet_has_columns(output_base/f'{month}'/f'{month}_{work_type}_windowed_transport_corrected.parquet',
+                                   WINDOWED_COLUMNS):
                 print(f"{month}-{work_type} already exists")
                 continue
             print(f"{month}-{work_type} processing")
@@ -47,12 +50,10 @@ for month in months:
                 COPY 
                 (SELECT
                     운행일자
-                    , 가상카드번호
-                    , 정류장ID
+                    , card_key
+                    , station_key
                     , hour
                     , type
-                    , 지역코드
-                    , 교통수단구분
                     , 정류장명칭
                     -- 좌표 뒤바뀐 경우 체크
                     , CASE WHEN y > 100 THEN 1
@@ -63,6 +64,9 @@ for month in months:
                         ELSE y END AS y
                     , CASE WHEN x < 100 THEN y
                         ELSE x END AS x
+                    -- 5179 좌표는 정류장 카탈로그에서 보정 후 변환된 값
+                    , x_5179
+                    , y_5179
                 FROM '{output_base}/{month}/{month}_{work_type}_windowed_transport.parquet'
                 ) TO '{output_base}/{month}/{month}_{work_type}_windowed_transport_corrected.parquet'
             ;''')
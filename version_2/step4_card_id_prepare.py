@@ -1,74 +1,201 @@
 """
 6개월 주거지, 직장지 윈도우 테이블에 동시에 존재하는 카드값의 고유값들로 테이블 생성
 config파일의 duckdb 경로로 테이블 산출
-배치 프로세스를 위한 1~10까지의 batch_id 부여
+배치 프로세스를 위한 batch_id 부여 (카드별 예상 클러스터링 비용으로 배치 간 작업량 균형)
+배치별로 카드번호 정렬된 주거지/직장지 테이블 재작성 (step5 배치 입력)
 """
 
+import os, shutil, heapq
 import duckdb
+import numpy as np
+import pyarrow as pa
 from config import CONFIG
 from utils import db_connection, ensure_dirs
+from card_index import available_months, ensure_index, num_cards, valid_card_mask, window_trips, window_stops
 
 def create_valid_cards_table():
+    """
+    유효 카드(주거지/직장지 윈도우 모두 MIN_WINDOW_TRIPS회 이상) + 카드별 통행 수/정류장 수 테이블 생성
+    월별 카드 활동 인덱스(card_index)의 벡터 연산으로 계산 -> 새로 들어온 월만 집계하고 통행 데이터 재스캔 없음
+    정류장 수는 step5가 클러스터링하는 점 수 추정치 (월별 최댓값)
+    """
     con = db_connection()
     print("Creating Valid_cards table...")
 
-    con.execute(f"""
-        CREATE OR REPLACE TABLE valid_cards AS
-        WITH home_cards AS (
-            SELECT 가상카드번호
-            FROM read_parquet('{CONFIG['DATA_DIR']}/*/*_residence_windowed_transport_corrected.parquet')
-        GROUP BY 가상카드번호
-        HAVING COUNT(*) >= 10
-        ),
-        work_cards AS (
-            SELECT 가상카드번호
-            FROM read_parquet('{CONFIG['DATA_DIR']}/*/*_office_windowed_transport_corrected.parquet')
-            GROUP BY 가상카드번호
-            HAVING COUNT(*) >= 10
-            )
-        SELECT 가상카드번호
-        FROM home_cards
-        INTERSECT
-        SELECT 가상카드번호
-        FROM work_cards
-    """)
+    months = available_months()
+    if not months:
+        print(f"    [ERR] no corrected residence/office windowed tables in {CONFIG['DATA_DIR']} (run step1~3 first)")
+        con.close()
+        raise SystemExit(1)
+    ensure_index(con, months)
+    n = num_cards()
+    mask = valid_card_mask(months, n=n)
+    cards = pa.table({
+        'card_key': np.flatnonzero(mask).astype(np.int64),
+        'home_cnt': window_trips(months, 'residence', n)[mask].astype(np.int64),
+        'work_cnt': window_trips(months, 'office', n)[mask].astype(np.int64),
+        'home_stops': window_stops(months, 'residence', n)[mask].astype(np.int64),
+        'work_stops': window_stops(months, 'office', n)[mask].astype(np.int64),
+        })
+    con.register('valid_cards_arrow', cards)
+    con.execute("CREATE OR REPLACE TABLE valid_cards AS SELECT * FROM valid_cards_arrow")
+    con.unregister('valid_cards_arrow')
 
     # 카드 수 확인
     count = con.execute("SELECT COUNT(*) FROM valid_cards").fetchone()[0]
-    print(f"Valid cards: {count:,}")
+    print(f"Valid cards: {count:,} ({months[0]}~{months[-1]}, {len(months)} months)")
 
     return con
 
+def estimate_costs(home_cnt, work_cnt, home_stops, work_stops):
+    """
+    카드별 예상 클러스터링 비용
+    반경 이웃 계산이 카드 내 점 쌍 수(정류장 수^2)에 비례 + 입력 통행 수만큼 읽기/집계
+    """
+    return (home_stops ** 2 + work_stops ** 2 + home_cnt + work_cnt).astype('int64')
+
+# 비용 상위 카드 중 heap으로 하나씩 배정할 라운드 수 (나머지는 numpy로 블록 단위 배정)
+GREEDY_ROUNDS = 64
+
+def pack_batches(costs, num_batches):
+    """
+    예상 비용 기준 배치 배정 (카드 수만큼의 Python 루프 없음)
+    1) 비용 내림차순 정렬
+    2) 상위 num_batches * GREEDY_ROUNDS장: 누적 비용이 가장 작은 배치에 배정 (greedy LPT)
+    3) 나머지: 블록 단위로 배치별 부족분(목표 누적 비용 - 현재 누적 비용)에 비례해서 연속 구간 배정
+       블록 크기는 2배씩 증가 -> 비용이 큰 앞부분은 자주 보정, 작은 비용이 대부분인 뒷부분은 한 번에
+    반환: (카드별 batch_id 배열, 배치별 누적 비용 배열)
+    """
+    costs = np.asarray(costs, dtype=np.int64)
+    order = np.argsort(-costs, kind='stable')
+    batch_ids = np.empty(len(costs), dtype=np.int32)
+
+    head = order[:num_batches * GREEDY_ROUNDS]
+    heap = [(0, b) for b in range(num_batches)]
+    for i in head:
+        load, b = heap[0]
+        batch_ids[i] = b
+        heapq.heapreplace(heap, (load + int(costs[i]), b))
+    loads = np.zeros(num_batches, dtype=np.int64)
+    for load, b in heap:
+        loads[b] = load
+
+    start, size = len(head), 2 * num_batches
+    while start < len(order):
+        block = order[start:start + size]
+        block_costs = costs[block]
+        cum = np.cumsum(block_costs)
+        # 블록까지 합친 균등 목표 대비 부족분 (모두 목표 이상이면 균등 분배)
+        deficit = np.clip((loads.sum() + cum[-1]) / num_batches - loads, 0, None)
+        if deficit.sum() == 0:
+            deficit = np.ones(num_batches)
+        lightest = np.argsort(loads, kind='stable')
+        bounds = np.cumsum(deficit[lightest] / deficit.sum() * cum[-1])
+        # 카드 비용 구간의 중간점이 속한 배치 구간으로 배정
+        slot = np.minimum(np.searchsorted(bounds, cum - block_costs / 2, side='right'), num_batches - 1)
+        batch_ids[block] = lightest[slot]
+        loads += np.bincount(lightest[slot], weights=block_costs, minlength=num_batches).astype(np.int64)
+        start += len(block)
+        size *= 2
+
+    return batch_ids, loads
+
 def assign_batches(con):
-    "배치 ID 할당"
+    "예상 클러스터링 비용 기준 배치 ID 할당 (valid_cards 재생성, UPDATE 없음)"
     print(f"Assigning {CONFIG['NUM_BATCHES']} batches...")
 
-    con.execute(f"""
-        ALTER TABLE valid_cards ADD COLUMN batch_id INTEGER;
+    cards = con.execute("""
+        SELECT card_key, home_cnt, work_cnt, home_stops, work_stops
+        FROM valid_cards
+        ORDER BY card_key
+    """).fetchnumpy()
+    costs = estimate_costs(cards['home_cnt'], cards['work_cnt'], cards['home_stops'], cards['work_stops'])
+    batch_ids, loads = pack_batches(costs, CONFIG['NUM_BATCHES'])
 
-        UPDATE valid_cards
-        SET batch_id = (hash(가상카드번호) % {CONFIG['NUM_BATCHES']});
+    assignment = pa.table({'card_key': cards['card_key'], 'cost': costs, 'batch_id': batch_ids})
+    con.register('assignment_arrow', assignment)
+    con.execute("""
+        CREATE OR REPLACE TABLE valid_cards AS
+        SELECT v.*
+            , a.cost
+            , a.batch_id
+        FROM valid_cards v
+        JOIN assignment_arrow a
+            ON v.card_key = a.card_key
     """)
+    con.unregister('assignment_arrow')
 
-    # 배치별 카드 수 확인
+    # 배치별 카드 수 / 예상 비용 확인
     batch_stats = con.execute("""
-        SELECT 
+        SELECT
             batch_id,
-            COUNT(*) as card_count
+            COUNT(*) as card_count,
+            SUM(home_cnt + work_cnt) as trip_count,
+            SUM(cost) as est_cost
         FROM valid_cards
         GROUP BY batch_id
         ORDER BY batch_id
     """).df()
+    batch_stats['cost_share'] = (batch_stats['est_cost'] / max(loads.sum(), 1)).round(4)
 
     print("\n===Batch Distribution===")
     print(batch_stats.to_string(index=False))
     print(f"\nAVG crads per batch: {batch_stats['card_count'].mean():.0f}")
+    if loads.sum():
+        print(f"Est. cost max/mean: {loads.max() / loads.mean():.3f}")
+
+def partition_by_batch(con):
+    """
+    보정된 주거지/직장지 윈도우 테이블을 batch_id로 hive 파티셔닝하여 1회 재작성
+    - 유효 카드만, step5에서 쓰는 컬럼만 포함
+    - 파티션 내부는 카드번호로 정렬 (row group 통계로 카드 범위 조회 가능)
+    출력: {BATCH_DATA_DIR}/{pattern}/batch_id={n}/data_0.parquet
+    """
+    for pattern_type in ['residence', 'office']:
+        output_dir = f"{CONFIG['BATCH_DATA_DIR']}/{pattern_type}"
+        staging_dir = f"{output_dir}_staging"
+        for path in [output_dir, staging_dir]:
+            shutil.rmtree(path, ignore_errors=True)
+
+        # 1. 전체 월 1회 스캔 -> 배치별 파티션 (정렬 전)
+        con.execute(f"""
+            COPY (
+                SELECT v.batch_id
+                    , w.card_key
+                    , w.station_key
+                    , w.정류장명칭
+                    , w.x_5179
+                    , w.y_5179
+                FROM read_parquet('{CONFIG['DATA_DIR']}/*/*_{pattern_type}_windowed_transport_corrected.parquet') w
+                JOIN valid_cards v
+                    ON w.card_key = v.card_key
+            ) TO '{staging_dir}'
+            (FORMAT PARQUET, PARTITION_BY (batch_id), COMPRESSION ZSTD)
+        """)
+
+        # 2. 파티션별 카드번호 정렬 (파티션 단위로 정렬 메모리 제한)
+        for batch_id in range(CONFIG['NUM_BATCHES']):
+            src = f"{staging_dir}/batch_id={batch_id}"
+            if not os.path.exists(src):
+                continue
+            os.makedirs(f"{output_dir}/batch_id={batch_id}", exist_ok=True)
+            con.execute(f"""
+                COPY (
+                    SELECT * EXCLUDE (batch_id)
+                    FROM read_parquet('{src}/*.parquet', hive_partitioning = true)
+                    ORDER BY card_key
+                ) TO '{output_dir}/batch_id={batch_id}/data_0.parquet'
+                (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 100000)
+            """)
+        shutil.rmtree(staging_dir)
+        print(f"{pattern_type} partitioned by batch into {output_dir}")
 
 def main():
     ensure_dirs()
 
     con = create_valid_cards_table()
     assign_batches(con)
+    partition_by_batch(con)
 
     print("\n Preparation completed")
     con.close()
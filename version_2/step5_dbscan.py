@@ -1,201 +1,323 @@
-import os, time, argparse
-import numpy as np
+import os, time, argparse, json, shutil
 import pandas as pd
-from sklearn.cluster import DBSCAN
-from multiprocessing import Pool
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import psutil
-from pyproj import Transformer
-from tqdm import tqdm 
 from pathlib import Path
+from glob import glob
 
 from config import CONFIG
-from utils import db_connection
+from utils import db_connection, ensure_dirs, load_station_dict, unpack_station_keys
+from clustering import find_main_clusters, check_parity
+
+# 배치 결과 스키마: 반복값이 많은 문자열 컬럼은 dictionary 인코딩
+# 카드는 card_key로 저장, 원래 가상카드번호(card_id)는 step6 내보내기 시점에 변환
+RESULT_SCHEMA = pa.schema([
+    ('card_key', pa.int64()),
+    ('stop_id', pa.int64()),
+    ('stop_name', pa.dictionary(pa.int32(), pa.string())),
+    ('region_code', pa.int64()),
+    ('transport_type', pa.dictionary(pa.int8(), pa.string())),
+    ('location_type', pa.dictionary(pa.int8(), pa.string())),
+    ('confidence', pa.float64()),
+    ('cluster_size', pa.int64()),
+    ('total_trips', pa.int64()),
+])
+
+def cluster_pattern(data, pattern_type, station_dict):
+    """
+    카드-정류장(좌표, 횟수) 데이터 -> 메인 클러스터 정류장 결과 (RESULT_SCHEMA)
+    data: 카드번호 순 정렬된 _load_pattern 형식 DataFrame
+    station_dict: 정류장 사전 (station_key -> 정류장ID, 지역코드, 교통수단구분)
+    """
+    # 1. 배치 전체 DBSCAN: 카드별 메인 클러스터 (정류장 카탈로그의 5179 좌표, 정류장 반복 횟수를 가중치로)
+    in_main, stats = find_main_clusters(
+        data['card_key'].to_numpy(), data['x_5179'].to_numpy(float), data['y_5179'].to_numpy(float),
+        eps=CONFIG['DBSCAN_EPS'], min_samples=CONFIG['DBSCAN_MIN_SAMPLES'],
+        weight=data['cnt'].to_numpy(float), projected=True)
+
+    # 2. 메인 클러스터 정류장: 카드별로 정류장 유니크하게 중복 제거
+    cluster_stops = data.loc[in_main, ['card_key', 'station_key', '정류장명칭']]
+    cluster_stops = cluster_stops.drop_duplicates(subset=['card_key', 'station_key'])
+
+    # 3. 카드별 클러스터 통계 결합 -> 정류장 키 풀어서 결과 스키마
+    result = cluster_stops.merge(stats, left_on='card_key', right_on='card', how='inner')
+    stop_id, region_code, transport_type = unpack_station_keys(result['station_key'], station_dict)
+    result = pd.DataFrame({
+        'card_key': result['card_key'],
+        'stop_id': stop_id,
+        'stop_name': result['정류장명칭'],
+        'region_code': region_code,
+        'transport_type': transport_type,
+        'location_type': pattern_type,
+        'confidence': result['confidence'],
+        'cluster_size': result['cluster_size'],
+        'total_trips': result['trips'],
+    })
+    print(f"    {pattern_type}: {len(stats)} cards clustered")
+    return pa.Table.from_pandas(result, schema=RESULT_SCHEMA, preserve_index=False)
 
 class BatchProcessor:
-    def __init__(self):
-        self.con = db_connection(read_only=True)
+    def __init__(self, memory_limit='100gb'):
+        self.con = db_connection(read_only=True, memory_limit=memory_limit)
+        self.station_dict = load_station_dict()
 
     def process_batch(self, batch_id):
-        """단일 배치 처리"""
+        """
+        단일 배치 처리
+        카드번호 순 청크 단위로 클러스터링하여 청크별 part 파일 + manifest에 기록하고,
+        모든 청크가 끝나면 part 파일을 batch_XX.parquet 하나로 합침
+        중단 후 재실행 시 manifest에 기록된 청크는 건너뜀
+        """
         checkpoint_file = f"{CONFIG['CHECKPOINT_DIR']}/batch_{batch_id:02d}.parquet"
+        parts_dir = f"{CONFIG['CHECKPOINT_DIR']}/batch_{batch_id:02d}.parts"
+        manifest_file = f"{CONFIG['CHECKPOINT_DIR']}/batch_{batch_id:02d}.manifest.json"
 
         # 이미 처리된 케이스
         if os.path.exists(checkpoint_file):
             print(f" Batch {batch_id} already exists")
-            return
+            return 0
 
         print(f" Processing batch {batch_id}...")
 
-        # 1. 배치의 카드 리스트 
-        cards = self.con.execute(f"""
-            SELECT 가상카드번호 
-            FROM valid_cards WHERE batch_id = {batch_id}
-        """).df()['가상카드번호'].tolist()
-
-        if len(cards) == 0:
+        # 1. 카드번호 순 청크 경계
+        bounds = self._chunk_bounds(batch_id)
+        if len(bounds) == 0:
             print(f" !Batch {batch_id} is empty")
-            return
-
-        # 2. 주거지/직장지 분석
-        residence_results = self._analyze_pattern(cards, 'residence')
-        office_results = self._analyze_pattern(cards, 'office')
-
-        # 3. 결과를 행 단위로 변환 (정규화) 
-        all_rows = []
-
-        # 주거지 정류장들 
-        for card_id, info in residence_results.items():
-            stops_df = info['stops_df']
-            
-            for _, row in stops_df.iterrows():
-                all_rows.append({
-                    'card_id':card_id,
-                    'stop_id':row['정류장ID'],
-                    'stop_name':row['정류장명칭'],
-                    'region_code':row['지역코드'],
-                    'transport_type':row['교통수단구분'],
-                    'location_type':'residence',
-                    'confidence':info['confidence'],
-                    'cluster_size':info['cluster_size'],
-                    'total_trips':info['trips']
-                })
-
-        # 직장지 정류장들
-        for card_id, info in office_results.items():
-            stops_df = info['stops_df']
-            
-            for _, row in stops_df.iterrows():
-                all_rows.append({
-                    'card_id':card_id,
-                    'stop_id':row['정류장ID'],
-                    'stop_name':row['정류장명칭'],
-                    'region_code':row['지역코드'],
-                    'transport_type':row['교통수단구분'],
-                    'location_type':'office',
-                    'confidence':info['confidence'],
-                    'cluster_size':info['cluster_size'],
-                    'total_trips':info['trips']
-                })
-
-        # 저장
-        if len(all_rows) > 0:
-            df_result = pd.DataFrame(all_rows)
-            df_result.to_parquet(checkpoint_file, index=False)
-            print(f" Batch {batch_id} done: {len(all_rows)} rows"
-                  f"(home: {len([r for r in all_rows if r['location_type']=='residence'])},"
-                  f"work: {len([r for r in all_rows if r['location_type'] =='office'])}")
+            return 0
+
+        # 2. manifest 확인: 청크 구성이 같을 때만 이어서 처리
+        manifest = {'chunk_cards': CONFIG['CHUNK_CARDS'], 'bounds': bounds, 'chunks': {}}
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                saved = json.load(f)
+            if saved['chunk_cards'] == manifest['chunk_cards'] and saved['bounds'] == bounds:
+                manifest = saved
+                print(f"    resuming batch {batch_id}: {len(manifest['chunks'])}/{len(bounds)} chunks done")
+        if not manifest['chunks']:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+        os.makedirs(parts_dir, exist_ok=True)
+
+        # 3. 청크별 주거지/직장지 분석 (카드-정류장 단위 컬럼형 결과) -> part 파일
+        for i, lo in enumerate(bounds):
+            if str(i) in manifest['chunks']:
+                continue
+            hi = bounds[i + 1] if i + 1 < len(bounds) else None
+            tables = [self._analyze_pattern(batch_id, pattern_type, lo, hi) for pattern_type in ['residence', 'office']]
+            result = pa.concat_tables(tables)
+
+            part_file = f"{parts_dir}/part_{i:05d}.parquet"
+            pq.write_table(result, part_file + '.tmp', compression='zstd')
+            os.replace(part_file + '.tmp', part_file)
+
+            manifest['chunks'][str(i)] = {'first_card': lo, 'next_card': hi, 'home': tables[0].num_rows,
+                                          'work': tables[1].num_rows}
+            with open(manifest_file + '.tmp', 'w') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(manifest_file + '.tmp', manifest_file)
+            print(f"    chunk {i + 1}/{len(bounds)} committed: {result.num_rows} rows")
+
+        # 4. part 파일 -> 체크포인트 (고정 크기 row group으로 스트리밍 병합)
+        # part 경계와 무관하게 ROW_GROUP_SIZE만큼 모일 때마다 기록, 나머지는 다음 part와 합침
+        row_group_size = CONFIG['ROW_GROUP_SIZE']
+        with pq.ParquetWriter(checkpoint_file + '.tmp', RESULT_SCHEMA, compression='zstd') as writer:
+            pending = RESULT_SCHEMA.empty_table()
+            for i in range(len(bounds)):
+                part = pq.read_table(f"{parts_dir}/part_{i:05d}.parquet").cast(RESULT_SCHEMA)
+                pending = pa.concat_tables([pending, part])
+                full = pending.num_rows // row_group_size * row_group_size
+                if full:
+                    writer.write_table(pending.slice(0, full), row_group_size=row_group_size)
+                    pending = pending.slice(full)
+            if pending.num_rows:
+                writer.write_table(pending, row_group_size=row_group_size)
+        os.replace(checkpoint_file + '.tmp', checkpoint_file)
+        shutil.rmtree(parts_dir)
+        os.remove(manifest_file)
+
+        home = sum(c['home'] for c in manifest['chunks'].values())
+        work = sum(c['work'] for c in manifest['chunks'].values())
+        if home + work > 0:
+            print(f" Batch {batch_id} done: {home + work} rows"
+                  f"(home: {home},"
+                  f"work: {work}")
         else:
             print(f" ! Batch {batch_id} has no valid results")
+        return home + work
+
+    def _chunk_bounds(self, batch_id):
+        "배치 카드를 카드번호 순으로 CHUNK_CARDS개씩 나눈 각 청크의 첫 카드번호"
+        return self.con.execute(f"""
+            SELECT card_key
+            FROM (
+                SELECT card_key
+                    , row_number() OVER (ORDER BY card_key) - 1 AS rn
+                FROM valid_cards
+                WHERE batch_id = {batch_id}
+                )
+            WHERE rn % {CONFIG['CHUNK_CARDS']} = 0
+            ORDER BY card_key
+        """).df()['card_key'].tolist()
 
-    def _analyze_pattern(self, card_ids, pattern_type):
+    def _load_pattern(self, batch_id, pattern_type, lo=None, hi=None):
+        """
+        배치 해당 주거지/직장지 데이터 로드 (step4에서 배치별로 파티셔닝된 파일만 읽음)
+        카드별 반복 정류장은 (정류장, 좌표, 횟수)로 묶어서 반환 - DBSCAN 가중치로 사용
+        lo, hi: 카드번호 범위 [lo, hi) - 카드번호 정렬 파일이라 row group 단위로 걸러짐
+        """
+        path = f"{CONFIG['BATCH_DATA_DIR']}/{pattern_type}/batch_id={batch_id}/*.parquet"
+        if not glob(path):
+            return pd.DataFrame(columns=['card_key', 'station_key', '정류장명칭', 'x_5179', 'y_5179', 'cnt'])
+        conditions, params = ['TRUE'], []
+        if lo is not None:
+            conditions.append('card_key >= ?')
+            params.append(lo)
+        if hi is not None:
+            conditions.append('card_key < ?')
+            params.append(hi)
+        return self.con.execute(f"""
+            SELECT card_key
+                    , station_key
+                    , MIN(정류장명칭) AS 정류장명칭
+                    , x_5179
+                    , y_5179
+                    , COUNT(*) AS cnt
+            FROM read_parquet('{path}')
+            WHERE {' AND '.join(conditions)}
+            GROUP BY card_key, station_key, x_5179, y_5179
+            ORDER BY card_key, station_key, x_5179, y_5179
+        """, params).df()
+
+    def _analyze_pattern(self, batch_id, pattern_type, lo=None, hi=None):
         " 주거지/직장지 패턴 분석"
-        card_list = "','".join(card_ids)
-        transformer = Transformer.from_crs("EPSG:4326", "EPSG:5179", always_xy=True)
-        # 1. 배치 해당 데이터 로드
-        data = self.con.execute(f"""
-            SELECT 가상카드번호
-                    , 정류장ID
-                    , 지역코드
-                    , 교통수단구분
-                    , 정류장명칭
-                    , x
-                    , y
-            FROM read_parquet('{CONFIG['DATA_DIR']}/*/*_{pattern_type}_windowed_transport_corrected.parquet')
-            WHERE 가상카드번호 IN ('{card_list}')
-        """).df()
-
-        results = {}
-
-        # 2. 카드 번호 순회: DBSCAN으로 클러스터 산출
-
-        data_groupby = data.groupby('가상카드번호', sort=False)
-        
-        for card_id, card_data in tqdm(data_groupby, total=data_groupby.ngroups):
-
-            try:
-                if len(card_data) < CONFIG['DBSCAN_MIN_SAMPLES']:
-                    continue
-                    
-                card_data = card_data.dropna(subset=['x', 'y']).copy()
-                # 좌표 변환 4326 -> 5179
-                x_5179, y_5179 = transformer.transform(card_data['x'].values, card_data['y'].values)
-    
-                # NaN값 드랍
-                valid_mask = ~(np.isnan(x_5179) | np.isnan(y_5179))
-    
-                # 남는게 없으면 continue
-                if len(valid_mask) < 1:
-                    continue
-                
-                # DBSCAN
-                coords_5179 = np.column_stack([x_5179[valid_mask], y_5179[valid_mask]])
-                # 최종 array가 0인 경우 필터
-                if len(coords_5179) == 0:
-                    continue
-                clustering = DBSCAN(
-                    eps=CONFIG['DBSCAN_EPS'],
-                    min_samples=CONFIG['DBSCAN_MIN_SAMPLES']
-                ).fit(coords_5179)
-    
-                labels = clustering.labels_
-    
-                # 노이즈만 있을 경우 스킵
-                if len(labels[labels>=0]) == 0:
+        # 배치(청크) 해당 데이터 로드 -> 클러스터링
+        data = self._load_pattern(batch_id, pattern_type, lo, hi)
+        return cluster_pattern(data, pattern_type, self.station_dict)
+
+    def check_parity(self, batch_id):
+        "배치 엔진과 기존 sklearn 경로 결과 비교"
+        for pattern_type in ['residence', 'office']:
+            data = self._load_pattern(batch_id, pattern_type)
+            mismatch = check_parity(
+                data['card_key'].to_numpy(), data['x_5179'].to_numpy(float), data['y_5179'].to_numpy(float),
+                eps=CONFIG['DBSCAN_EPS'], min_samples=CONFIG['DBSCAN_MIN_SAMPLES'],
+                weight=data['cnt'].to_numpy(), projected=True)
+            status = 'SUC' if mismatch == 0 else 'ERR'
+            print(f"    [{status}] batch {batch_id} {pattern_type}: {mismatch} cards differ from sklearn path")
+
+def process_wrapper(batch_id, memory_limit):
+    "멀티프로세싱 래퍼: (batch_id, 결과 행 수, 소요시간) 반환"
+    t0 = time.time()
+    processor = BatchProcessor(memory_limit=memory_limit)
+    rows = processor.process_batch(batch_id)
+    processor.con.close()
+    return batch_id, rows, time.time() - t0
+
+def estimate_batch_rows(batch_ids):
+    """
+    배치별 입력 행 수 (배치 파티션 parquet 메타데이터 기준)
+    """
+    con = db_connection(read_only=True)
+    est_rows = {}
+    for batch_id in batch_ids:
+        est_rows[batch_id] = 0
+        for pattern_type in ['residence', 'office']:
+            path = f"{CONFIG['BATCH_DATA_DIR']}/{pattern_type}/batch_id={batch_id}/*.parquet"
+            if glob(path):
+                est_rows[batch_id] += con.execute(f"SELECT COUNT(*) FROM read_parquet('{path}')").fetchone()[0]
+    con.close()
+    return est_rows
+
+def plan_workers(est_rows):
+    """
+    가용 메모리 대비 배치 크기로 워커 수 결정
+    반환: (워커 수, 워커당 DuckDB memory_limit)
+    """
+    available = psutil.virtual_memory().available * CONFIG['MEMORY_FRACTION']
+    largest = max(est_rows.values(), default=0) * CONFIG['BYTES_PER_ROW']
+    workers = CONFIG['NUM_WORKERS'] if largest == 0 else int(available // largest)
+    workers = max(1, min(workers, CONFIG['NUM_WORKERS'], len(est_rows)))
+    memory_limit = f"{max(1, int(available / workers / 1024**3))}GB"
+    return workers, memory_limit
+
+def run_batches(batch_ids):
+    """
+    배치 병렬 처리
+    - 완료된 체크포인트는 스킵, 예상 행 수가 큰 배치부터 투입
+    - 실패한 배치는 CONFIG['BATCH_RETRIES']회까지 재시도
+    반환: 최종 실패 배치 리스트
+    """
+    pending = [b for b in batch_ids
+               if not Path(f"{CONFIG['CHECKPOINT_DIR']}/batch_{b:02d}.parquet").exists()]
+    for b in sorted(set(batch_ids) - set(pending)):
+        print(f"    [SKIP] BatchId-{b:02d} is already there.")
+    if not pending:
+        return []
+
+    est_rows = estimate_batch_rows(pending)
+    workers, memory_limit = plan_workers(est_rows)
+    print(f"Processing {len(pending)} batches with {workers} workers (memory_limit={memory_limit}/worker)", flush=True)
+
+    attempts = {b: 0 for b in pending}
+    total_rows = max(sum(est_rows.values()), 1)
+    done_rows, done, failed = 0, 0, []
+    t0 = time.time()
+
+    while pending:
+        pending.sort(key=lambda b: est_rows[b], reverse=True)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(process_wrapper, b, memory_limit): b for b in pending}
+            pending = []
+            for future in as_completed(futures):
+                batch_id = futures[future]
+                try:
+                    _, rows, elapsed = future.result()
+                except Exception as e:
+                    attempts[batch_id] += 1
+                    if attempts[batch_id] <= CONFIG['BATCH_RETRIES']:
+                        print(f"    [RETRY] BatchId-{batch_id:02d} ({attempts[batch_id]}/{CONFIG['BATCH_RETRIES']}): {e}")
+                        pending.append(batch_id)
+                    else:
+                        print(f"    [ERR] BatchId-{batch_id:02d} failed: {e}")
+                        failed.append(batch_id)
                     continue
-    
-                # 가장 큰 클러스터 검출
-                unique_labels, counts = np.unique(labels[labels>=0], return_counts=True)
-                main_cluster = unique_labels[np.argmax(counts)]
-    
-                # 메인 클러스터 해당 데이터프레임 copy
-                cluster_mask = labels == main_cluster
-                cluster_data = card_data[cluster_mask].copy()
-    
-                # 정류장별로 유니크하게 중복 제거
-                cluster_stops_df = cluster_data[['정류장ID', '정류장명칭', '지역코드', '교통수단구분']].drop_duplicates(subset=['정류장ID', '지역코드', '교통수단구분'])
-                
-                cluster_size = np.sum(cluster_mask)
-                confidence = round(cluster_size/len(card_data),2)
-    
-                # 신뢰도 기준
-                print(f"\r    card_id: {card_id[:5]} Done")
-                results[card_id] = {
-                   'stops_df':  cluster_stops_df,
-                    'confidence': confidence,
-                    'trips': len(card_data),
-                    'cluster_size': cluster_size
-                }
-            except Exception as e:
-                print(f"[Error] card_id: {card_id} \n error: {e}")
-        return results
-
-def process_wrapper(batch_id):
-    "멀티프로세싱 래퍼"
-    processor = BatchProcessor()
-    processor.process_batch(batch_id)
+
+                # 진행률/ETA: 예상 행 수 기준
+                done += 1
+                done_rows += est_rows[batch_id]
+                spent = time.time() - t0
+                eta = spent / done_rows * (total_rows - done_rows) if done_rows else 0
+                print(f"    [SUC] BatchId-{batch_id:02d}: {rows} rows, {elapsed:.1f}s "
+                      f"| {done}/{len(attempts)} batches, elapsed {spent/60:.1f}m, ETA {eta/60:.1f}m", flush=True)
+
+    return failed
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--batch', type=int)
+    parser.add_argument('--check_parity', action='store_true', help='--batch 배치에 대해 sklearn 경로와 결과 비교')
     args = parser.parse_args()
-    
+
+    # sklearn 경로와 결과 비교
+    if args.check_parity:
+        BatchProcessor().check_parity(args.batch if args.batch is not None else 0)
+        return
+
     # 단일 배치 처리
     if args.batch is not None:
         processor = BatchProcessor()
         processor.process_batch(args.batch)
         return
 
-    # 전체 배치 순차적 처리
+    # 전체 배치 병렬 처리
+    ensure_dirs()
     print(f"Processing all batches...", flush=True)
-    
-    for batch_id in range(CONFIG['NUM_BATCHES']):
-        # 배치 체크포인트가 있을 때 스킵처리
-        if Path(f"{CONFIG['CHECKPOINT_DIR']}/batch_{batch_id:02d}.parquet").exists():
-            print(f"    [SKIP] BatchId-{batch_id:02d} is already there.")
-        t0 = time.time()
-        processor = BatchProcessor()
-        processor.process_batch(batch_id)
-        print(f"\n All batches processed elapsed time: {time.time()-t0:.1f}s")
+    t0 = time.time()
+    failed = run_batches(list(range(CONFIG['NUM_BATCHES'])))
+    if failed:
+        print(f"\n [ERR] failed batches: {failed}")
+    print(f"\n All batches processed elapsed time: {time.time()-t0:.1f}s")
 
 
 if __name__ == "__main__":
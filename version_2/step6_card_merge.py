@@ -3,17 +3,17 @@
 """
 
 from config import CONFIG
-from utils import db_connection
+from utils import db_connection, export_card_ids_sql
 
 def main():
     con = db_connection()
 
     print("Merging checkpoint files...")
 
-    # 1. 체크포인트 통합 
+    # 1. 체크포인트 통합 (card_key -> 카드 사전의 가상카드번호 card_id로 변환)
     con.execute(f"""
         CREATE OR REPLACE TABLE od_mapping AS
-        SELECT * FROM read_parquet('{CONFIG['CHECKPOINT_DIR']}/batch_*.parquet')
+        {export_card_ids_sql(f"read_parquet('{CONFIG['CHECKPOINT_DIR']}/batch_*.parquet')")}
     """)
 
     # 2. 간단한 통계 확인
@@ -14,14 +14,13 @@ loop:
 
 import argparse, time, os
 from pathlib import Path
-from pyproj import Transformer
 import numpy as np
 import pandas as pd
 
 from config import CONFIG
-from utils import db_connection, between_months, to_grid_vec
-
-transformer = Transformer.from_crs("EPSG:4326", "EPSG:5179", always_xy=True)
+from utils import db_connection, between_months
+from stations import load_stations
+from grid import register_grid_macros
 
 def main():
     ap = argparse.ArgumentParser()
@@ -37,35 +36,26 @@ def main():
 
     # db initialize
     con = db_connection()
+    register_grid_macros(con)
     for month in months:
         output_path = f'output/station_cleansed/{month}/{month}15_station_cleansed.parquet'
         os.makedirs(Path(output_path).parent, exist_ok=True)
         print(f"{month}15 station data cleasing...")
+        # 1. 정류장 카탈로그(x, y 보정 + 5179 변환 + 그리드)에서 가져옴
         station_corrected = con.execute(f"""
-            -- 1. x, y 좌표 다른 것 수정
-            SELECT 지역코드
-                , 교통수단구분
-                , (정류장ID::BIGINT)::VARCHAR AS 정류장ID
+            SELECT 정류장ID::VARCHAR AS 정류장ID
                 , 정류장명칭
-                , CASE WHEN 정류장GPSY좌표 > 100 THEN 정류장GPSX좌표
-                    ELSE 정류장GPSY좌표 END AS y
-                , CASE WHEN 정류장GPSX좌표 < 100 THEN 정류장GPSY좌표
-                    ELSE 정류장GPSX좌표 END AS x
-            FROM read_csv('import_data/TB_KTS_STTN/{month}/TB_KTS_STTN_{month}15.csv')
-            WHERE 정류장GPSX좌표 IS NOT NULL 
-                AND 정류장GPSY좌표 IS NOT NULL
-                AND 정류장GPSX좌표 < 1000
-                AND 정류장GPSY좌표 < 1000
+                , 지역코드
+                , 교통수단구분
+                , x_5179
+                , y_5179
+                , grid_id(grid_code) AS grid_id
+            FROM {load_stations(con, month)}
+            WHERE x IS NOT NULL 
+                AND y IS NOT NULL
+                AND x < 1000
+                AND y < 1000
             """).df()
-        
-        # 5179로 변환 
-        x, y = station_corrected.x.to_numpy(float), station_corrected.y.to_numpy(float)
-        x_5179, y_5179 = transformer.transform(x, y)
-        station_corrected['x_5179'], station_corrected['y_5179'] = x_5179, y_5179
-        
-        # 그리드화
-        station_corrected['grid_id'] = to_grid_vec(x_5179, y_5179)
-        station_corrected = station_corrected[['정류장ID', '정류장명칭', '지역코드', '교통수단구분', 'x_5179', 'y_5179', 'grid_id']]
 
         # 파일로 저장 
         station_corrected.to_parquet(output_path)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# version_2 모듈은 패키지가 아니라 스크립트 디렉토리 기준 import (from utils import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
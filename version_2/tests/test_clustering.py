@@ -0,0 +1,109 @@
+"""
+배치 DBSCAN 엔진(find_main_clusters)과 기존 카드별 sklearn 경로(sklearn_main_clusters) 비교
+합성 5179 좌표(projected=True)로 메인 클러스터 소속(labels)과 카드별 메인 클러스터 중심이 같은지 확인
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import clustering
+from clustering import find_main_clusters, sklearn_main_clusters
+
+EPS = 100
+MIN_SAMPLES = 4
+
+def _centroids(cards, x, y, in_main, weight=None):
+    "카드별 메인 클러스터 (가중) 중심"
+    w = np.ones(len(x)) if weight is None else np.asarray(weight, dtype=float)
+    df = pd.DataFrame({'card': cards, 'wx': x * w, 'wy': y * w, 'w': w})[in_main]
+    g = df.groupby('card')[['wx', 'wy', 'w']].sum()
+    return pd.DataFrame({'x': g['wx'] / g['w'], 'y': g['wy'] / g['w']}).sort_index()
+
+def assert_parity(cards, x, y, weight=None, eps=EPS, min_samples=MIN_SAMPLES):
+    """
+    엔진과 sklearn 경로의 메인 클러스터 소속/중심/통계가 같은지 검사
+    weight가 있으면 sklearn은 반복 횟수만큼 펼친 점으로 계산
+    """
+    cards, x, y = np.asarray(cards), np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    in_main_a, stats_a = find_main_clusters(cards, x, y, eps, min_samples, weight, projected=True)
+
+    rep = np.arange(len(cards)) if weight is None else np.repeat(np.arange(len(cards)), weight)
+    in_main_b, stats_b = sklearn_main_clusters(cards[rep], x[rep], y[rep], eps, min_samples, projected=True)
+
+    np.testing.assert_array_equal(in_main_a[rep], in_main_b)
+    pd.testing.assert_frame_equal(_centroids(cards, x, y, in_main_a, weight),
+                                  _centroids(cards[rep], x[rep], y[rep], in_main_b))
+    a = stats_a.set_index('card').sort_index()
+    b = stats_b.set_index('card').sort_index()
+    assert list(a.index) == list(b.index)
+    np.testing.assert_array_equal(a['cluster_size'].to_numpy(np.int64), b['cluster_size'].to_numpy(np.int64))
+    np.testing.assert_array_equal(a['trips'].to_numpy(np.int64), b['trips'].to_numpy(np.int64))
+    np.testing.assert_array_equal(a['confidence'].to_numpy(float), b['confidence'].to_numpy(float))
+    return in_main_a
+
+def _random_cards(rng, n_cards, base=(950000, 1950000)):
+    "카드별 2~3개 군집 + 노이즈 점"
+    cards, xs, ys = [], [], []
+    for card in range(n_cards):
+        for _ in range(rng.integers(2, 4)):
+            cx, cy = base[0] + rng.uniform(-5000, 5000), base[1] + rng.uniform(-5000, 5000)
+            k = rng.integers(1, 15)
+            xs.append(cx + rng.normal(0, 40, k))
+            ys.append(cy + rng.normal(0, 40, k))
+            cards.append(np.full(k, f'card{card:03d}'))
+    return np.concatenate(cards), np.concatenate(xs), np.concatenate(ys)
+
+def test_random_cards():
+    cards, x, y = _random_cards(np.random.default_rng(0), 60)
+    assert_parity(cards, x, y)
+
+def test_weighted_points():
+    rng = np.random.default_rng(1)
+    cards, x, y = _random_cards(rng, 40)
+    weight = rng.integers(1, 5, len(cards))
+    assert_parity(cards, x, y, weight=weight)
+
+def test_nan_coordinates():
+    rng = np.random.default_rng(2)
+    cards, x, y = _random_cards(rng, 40)
+    nan = rng.random(len(cards)) < 0.1
+    x[nan] = np.nan
+    y[rng.random(len(cards)) < 0.05] = np.nan
+    # 좌표가 모두 NaN인 카드
+    cards = np.concatenate([cards, np.full(6, 'all_nan')])
+    x = np.concatenate([x, np.full(6, np.nan)])
+    y = np.concatenate([y, np.full(6, np.nan)])
+    assert_parity(cards, x, y)
+
+def test_cluster_size_tie_picks_first_cluster():
+    # 같은 크기 군집 2개: 먼저 등장한 군집이 메인
+    x = np.array([5000, 5010, 5020, 5030, 0, 10, 20, 30], dtype=float)
+    y = np.zeros(8)
+    in_main = assert_parity(np.full(8, 'tie'), x, y)
+    np.testing.assert_array_equal(in_main, [True] * 4 + [False] * 4)
+
+@pytest.mark.parametrize('c_first', [False, True])
+def test_border_reachable_from_two_cores(c_first):
+    # B(115, 0)는 이웃이 자기 자신 + 양쪽 core 1개씩 = 3 < MIN_SAMPLES -> border
+    # B가 먼저 등장한 군집에 붙어야 크기 5:5 동률 -> 그 군집이 메인
+    a = [(0, 0), (5, 0), (10, 0), (20, 0)]
+    c = [(210, 0), (220, 0), (225, 0), (230, 0), (240, 0)]
+    points = (c + [(115, 0)] + a) if c_first else (a + [(115, 0)] + c)
+    x, y = np.array(points, dtype=float).T
+    in_main = assert_parity(np.full(len(points), 'border'), x, y)
+    assert in_main[points.index((115, 0))]
+
+def test_pair_budget_tiling(monkeypatch):
+    rng = np.random.default_rng(3)
+    cards, x, y = _random_cards(rng, 30)
+    # 점이 많은 카드 1개 (n^2 > PAIR_BUDGET)
+    heavy = 400
+    cards = np.concatenate([cards, np.full(heavy, 'heavy')])
+    x = np.concatenate([x, 950000 + rng.normal(0, 150, heavy)])
+    y = np.concatenate([y, 1950000 + rng.normal(0, 150, heavy)])
+
+    expected = find_main_clusters(cards, x, y, EPS, MIN_SAMPLES, projected=True)
+    monkeypatch.setattr(clustering, 'PAIR_BUDGET', 1000)
+    tiled = assert_parity(cards, x, y)
+    np.testing.assert_array_equal(tiled, expected[0])
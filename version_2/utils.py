@@ -1,18 +1,20 @@
 import os
 import duckdb
 import numpy as np
+import pandas as pd
 
 def ensure_dirs():
     "필요한 디렉토리 생성"
     from config import CONFIG
     os.makedirs(CONFIG['CHECKPOINT_DIR'], exist_ok=True)
     os.makedirs(CONFIG['OUTPUT_DIR'], exist_ok=True)
+    os.makedirs(CONFIG['BATCH_DATA_DIR'], exist_ok=True)
 
-def db_connection(read_only=False):
+def db_connection(read_only=False, memory_limit='100gb'):
     # DuckDB 연결
     from config import CONFIG
     con = duckdb.connect(CONFIG['DB_PATH'], read_only=read_only)
-    con.execute("SET memory_limit='100gb'")
+    con.execute(f"SET memory_limit='{memory_limit}'")
     return con
 
 def between_months(s, e):
@@ -28,34 +30,140 @@ def between_months(s, e):
             month = 1
     return months
 
-# x, y 좌표 -> grid로 변환
-def to_grid_vec(x, y):
-    xi = np.floor(x / 100000 -7).astype('int64')
-    yi = np.floor(y / 100000 -14).astype('int64')
+# 윈도우 테이블(step2/step3) 필수 컬럼: 예전 형식(가상카드번호, 좌표 미변환) 파일은 다시 생성
+WINDOWED_COLUMNS = ['card_key', 'station_key', 'x_5179', 'y_5179']
 
-    # 알파벳 매칭 
-    ox_mapping = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
-    oy_mapping = ['B', 'C', 'D', 'E', 'F', 'G', 'H']
-    max_idx = len(ox_mapping) - 1
+def parquet_has_columns(path, columns):
+    "parquet 파일이 있고 columns를 모두 포함하는지 (스키마만 읽음)"
+    import pyarrow.parquet as pq
+    return os.path.exists(path) and set(columns) <= set(pq.read_schema(str(path)).names)
 
-    xi_clipped = np.clip(xi, 0, max_idx)
-    yi_clipped = np.clip(yi, 0, max_idx)
+# 목적통행 파생 컬럼 (step1에서 1회 계산, 이후 단계는 문자열 파싱 없이 정수/불리언 비교)
+# 운행일(DATE), 승차시각/하차시각(TIMESTAMP), 승차hour/하차hour(TINYINT), 영업일(BOOLEAN, calendar_dim 조회)
+def ymd_date_sql(col):
+    "yyyymmdd 정수 -> DATE SQL 식 (문자열 파싱 없음)"
+    return f"make_date(({col} // 10000)::INT, ({col} // 100 % 100)::INT, ({col} % 100)::INT)"
 
-    # 접두사 생성
-    prefix = np.char.add(
-        np.array(ox_mapping)[xi_clipped],
-        np.array(oy_mapping)[yi_clipped]
-    )
-    # 접미사 생성
-    mod = 100000
-    x_suffix = (np.floor(np.abs(x)).astype('int64') % mod)
-    x_suffix_str = np.char.zfill(x_suffix.astype(str), 5)
+def ymdhms_timestamp_sql(col):
+    "yyyymmddHHMMSS 정수 -> TIMESTAMP SQL 식 (문자열 파싱 없음, 형식이 잘못된 값은 NULL)"
+    return (f"try(make_timestamp({col} // 10000000000, {col} // 100000000 % 100, {col} // 1000000 % 100, "
+            f"{col} // 10000 % 100, {col} // 100 % 100, ({col} % 100)::DOUBLE))")
 
-    y_suffix = (np.floor(np.abs(y)).astype('int64') % mod)
-    y_suffix_str = np.char.zfill(y_suffix.astype(str), 5)
+def ymdhms_hour_sql(col):
+    "yyyymmddHHMMSS 정수 -> 시(TINYINT) SQL 식"
+    return f"({col} // 10000 % 100)::TINYINT"
 
-    suffix = np.char.add(x_suffix_str, y_suffix_str)
+def hour_window_sql(col, window):
+    "hour 컬럼이 (시작, 끝) 윈도우 안인지 SQL 조건"
+    start, end = window
+    return f"{col} BETWEEN {start} AND {end}"
 
-    grid_id = np.char.add(prefix, suffix)
+def trip_window_sql(window, alias=None):
+    "승차/하차 hour가 모두 윈도우 안인 통행 SQL 조건"
+    p = f"{alias}." if alias else ""
+    return f"{hour_window_sql(f'{p}승차hour', window)} AND {hour_window_sql(f'{p}하차hour', window)}"
 
-    return grid_id
\ No newline at end of file
+def _append_dict(con, source, path, key, key_type, columns):
+    """
+    사전 parquet에 없는 값 조합에 정수 키 부여 (append-only)
+    키는 0부터 빈 번호 없이 증가 -> 한번 부여된 키는 바뀌지 않음 (새 값은 값 순서대로 뒤에 추가)
+    columns: {컬럼명: 타입}, source: 해당 컬럼을 가진 테이블명 또는 서브쿼리
+    반환: 새로 추가된 행 수
+    """
+    names = list(columns)
+    empty = ', '.join([f"NULL::{key_type} AS {key}"] + [f"NULL::{t} AS {c}" for c, t in columns.items()])
+    current = f"read_parquet('{path}')" if os.path.exists(path) else f"(SELECT {empty} WHERE FALSE)"
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE dict_cur AS
+        SELECT * FROM {current};
+
+        CREATE OR REPLACE TEMP TABLE dict_new AS
+        WITH new AS (
+            SELECT DISTINCT {', '.join(f'{c}::{t} AS {c}' for c, t in columns.items())}
+            FROM {source}
+            WHERE {' AND '.join(f'{c} IS NOT NULL' for c in names)}
+            EXCEPT
+            SELECT {', '.join(names)}
+            FROM dict_cur
+            )
+        SELECT (COALESCE((SELECT MAX({key}) FROM dict_cur), -1)
+                + row_number() OVER (ORDER BY {', '.join(names)}))::{key_type} AS {key}
+            , {', '.join(names)}
+        FROM new;
+    """)
+    added = con.execute("SELECT COUNT(*) FROM dict_new").fetchone()[0]
+    if added or not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        con.execute(f"""
+            COPY (
+                SELECT * FROM dict_cur
+                UNION ALL
+                SELECT * FROM dict_new
+                ORDER BY {key}
+                ) TO '{path}.tmp'
+            (FORMAT PARQUET, COMPRESSION ZSTD)
+        """)
+        os.replace(path + '.tmp', path)
+    con.execute("DROP TABLE dict_cur")
+    con.execute("DROP TABLE dict_new")
+    return added
+
+def update_station_dict(con, source):
+    """
+    정류장 사전에 없는 (정류장ID, 지역코드, 교통수단구분)에 INT32 키 부여 (append-only)
+    키는 0부터 빈 번호 없이 증가 -> 전체 월에서 같은 정류장은 같은 키
+    source: 세 컬럼을 가진 테이블명 또는 서브쿼리
+    반환: 새로 추가된 정류장 수
+    """
+    from config import CONFIG
+    return _append_dict(con, source, CONFIG['STATION_DICT_PATH'], 'station_key', 'INTEGER',
+                        {'정류장ID': 'BIGINT', '지역코드': 'BIGINT', '교통수단구분': 'VARCHAR'})
+
+def update_card_dict(con, source):
+    """
+    카드 사전에 없는 가상카드번호에 BIGINT 키(card_key) 부여 (append-only, 월이 바뀌어도 같은 카드는 같은 키)
+    source: 가상카드번호 컬럼을 가진 테이블명 또는 서브쿼리
+    반환: 새로 추가된 카드 수
+    """
+    from config import CONFIG
+    return _append_dict(con, source, CONFIG['CARD_DICT_PATH'], 'card_key', 'BIGINT', {'가상카드번호': 'VARCHAR'})
+
+def card_dict_sql():
+    "FROM 절에 쓰는 카드 사전 read_parquet SQL (card_key, 가상카드번호)"
+    from config import CONFIG
+    return f"read_parquet('{CONFIG['CARD_DICT_PATH']}')"
+
+def station_dict_sql():
+    "FROM 절에 쓰는 정류장 사전 read_parquet SQL (station_key, 정류장ID, 지역코드, 교통수단구분)"
+    from config import CONFIG
+    return f"read_parquet('{CONFIG['STATION_DICT_PATH']}')"
+
+def export_card_ids_sql(source):
+    "card_key 컬럼을 원래 가상카드번호(card_id)로 바꾼 SELECT (내보내기 시점에만 사용)"
+    return f"""
+        SELECT d.가상카드번호 AS card_id, s.* EXCLUDE (card_key)
+        FROM {source} s
+        JOIN {card_dict_sql()} d
+            ON s.card_key = d.card_key"""
+
+def load_station_dict():
+    "정류장 사전 (키 순서 = 행 순서)"
+    from config import CONFIG
+    return pd.read_parquet(CONFIG['STATION_DICT_PATH']).sort_values('station_key', ignore_index=True)
+
+def unpack_station_keys(keys, station_dict=None):
+    "INT32 키 배열 -> (정류장ID, 지역코드, 교통수단구분) 배열 (키가 곧 사전 행 번호)"
+    d = load_station_dict() if station_dict is None else station_dict
+    keys = np.asarray(keys, dtype=np.int64)
+    return (d['정류장ID'].to_numpy()[keys], d['지역코드'].to_numpy()[keys],
+            d['교통수단구분'].to_numpy()[keys])
+
+_transformer = None
+
+def to_5179(x, y):
+    "EPSG:4326 -> EPSG:5179 좌표 변환 (Transformer는 프로세스당 1회 생성)"
+    global _transformer
+    if _transformer is None:
+        from pyproj import Transformer
+        _transformer = Transformer.from_crs("EPSG:4326", "EPSG:5179", always_xy=True)
+    return _transformer.transform(x, y)